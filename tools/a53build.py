@@ -3,14 +3,24 @@ import re
 import sys
 import os
 import subprocess
+import hashlib
+import functools
+import contextlib
 from firstfit import ffd_add, slices_union, slices_find, slices_remove
+import binpack
 from innie import InnieParser
 from pb53 import pb53
 import donut
+import donutlib
 import a53charset
-from dtefe import dte_compress
+from dtefe import dte_compress_cached, dte_cache_key
+from buildcache import BuildCache, default_cache_dir
+from buildmanifest import BuildManifest, ManifestCache
+from buildstats import BuildStats
+from romimage import RomImage
 
 import crc16xmodem
+from a53checksum import parse_key_block
 
 trace = True
 trace_parser = False
@@ -19,42 +29,58 @@ default_title_screen = '../tilesets/title_screen.png'
 default_title_palette = bytes.fromhex('0f0010200f1626200f1A2A200f122220')
 default_menu_prg = '../../a53menu.prg'
 
+def screenshot_dcb_blocks(tiledata):
+    """Interleave screenshot tile data with don't care masks.
 
-def donut_compress(d):
-    return donut.compress(d)
-def compress_screenshot_tiledata(tiledata):
-    result = []
+Each 96 bytes of tiledata (4 tiles' planes 0 and 1, then their
+plane 2) becomes a background block whose pixels covered by plane 2
+are don't care, then a foreground block with no don't care bits,
+each followed by its mask in the format of
+donutlib.compress_with_dont_care().
+"""
+    data = []
     for i in range(0, len(tiledata), 96):
         bg_block = tiledata[i:i+64]
         fg_mask = b''.join(tiledata[i+p+64:i+p+64+8]+tiledata[i+p+64:i+p+64+8] for p in range(0, 32, 8))
         fg_block = bytes(t & m for t, m in zip(bg_block, fg_mask))
-        bg_mask = bytes(~m&0xff for m in fg_mask)
-        result.append(donut.compress_single_block(bg_block, bg_mask))
-        result.append(donut.compress_single_block(fg_block))
-    return b''.join(result)
-# If avaliable on the system path, try using the fast encoder for the Donut Codec.
-try:
-    donut_path = os.path.join(os.path.dirname(__file__), "donut")
-    if subprocess.run([donut_path, "--help"], stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout[0:20] == b'Donut NES CHR Codec\n':
-        def donut_compress(d):
-            return subprocess.run([donut_path, "-c"], input=d, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
-    if subprocess.run([donut_path, "--interleaved-dont-care-bits", "--help"], stdout=subprocess.PIPE, stderr=subprocess.PIPE).returncode == 0:
-        def compress_screenshot_tiledata(tiledata):
-            data = []
-            for i in range(0, len(tiledata), 96):
-                bg_block = tiledata[i:i+64]
-                fg_mask = b''.join(tiledata[i+p+64:i+p+64+8]+tiledata[i+p+64:i+p+64+8] for p in range(0, 32, 8))
-                fg_block = bytes(t & m for t, m in zip(bg_block, fg_mask))
-                bg_mask = bytes(~m&0xff for m in fg_mask)
-                data.append(bg_block)
-                data.append(fg_mask)
-                data.append(fg_block)
-                data.append(b'\x00'*64)
-            d = b''.join(data)
-            return subprocess.run([donut_path, "--interleaved-dont-care-bits", "-c"], input=d, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
-    print("Using compiled Donut executable", file=sys.stderr)
-except FileNotFoundError:
-    pass
+        data.append(bg_block)
+        data.append(fg_mask)
+        data.append(fg_block)
+        data.append(b'\x00'*64)
+    return b''.join(data)
+
+# Use the C Donut encoder in-process if libdonut is built, or
+# donut.py if not.  donut_codec_id identifies the encoder in use,
+# because the C and Python encoders can produce different (equally
+# valid) output for the same input.  Cache keys include this.
+donut_codec_id = donutlib.codec_id
+
+def donut_compress(d, cycle_limit=donutlib.DEFAULT_CYCLE_LIMIT):
+    return donutlib.compress(d, cycle_limit=cycle_limit)
+def compress_screenshot_tiledata(tiledata,
+                                 cycle_limit=donutlib.DEFAULT_CYCLE_LIMIT):
+    return donutlib.compress_with_dont_care(screenshot_dcb_blocks(tiledata),
+                                            cycle_limit=cycle_limit)
+
+# Without the library, the donut executable is still faster than
+# donut.py despite starting a process for each call.
+if donutlib.native:
+    print("Using compiled Donut library", file=sys.stderr)
+else:
+    try:
+        donut_path = os.path.join(os.path.dirname(__file__), "donut")
+        if subprocess.run([donut_path, "--help"], stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout[0:20] == b'Donut NES CHR Codec\n':
+            donut_codec_id = subprocess.run([donut_path, "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode('ascii', 'replace').strip() + ' (C)'
+            def donut_compress(d, cycle_limit=donutlib.DEFAULT_CYCLE_LIMIT):
+                return subprocess.run([donut_path, "--cycle-limit", str(cycle_limit), "-c"], input=d, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+        if subprocess.run([donut_path, "--interleaved-dont-care-bits", "--help"], stdout=subprocess.PIPE, stderr=subprocess.PIPE).returncode == 0:
+            def compress_screenshot_tiledata(tiledata, cycle_limit=donutlib.DEFAULT_CYCLE_LIMIT):
+                d = screenshot_dcb_blocks(tiledata)
+                return subprocess.run([donut_path, "--interleaved-dont-care-bits", "--cycle-limit", str(cycle_limit), "-c"], input=d, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+        print("Using compiled Donut executable", file=sys.stderr)
+    except FileNotFoundError:
+        if donutlib.donutnp:
+            print("Using NumPy Donut encoder", file=sys.stderr)
 
 # DTE compression uses code units greater than any existing code
 # unit in a53charset to represent pairs (or more) of characters.
@@ -565,7 +591,10 @@ titles is a list of dicts, which generally have items
 'rom': filename
 roms is a list of (filename, romdata) pairs, where each romdata
 is a dict returned by load_ines(), with elements 'prg' and 'chr'
-and arrays 'base' and 'resetpoints' with one element per 32k bank
+and arrays 'base' and 'resetpoints' with one element per 32k bank.
+'prg' and 'chr' are views of a memory map of the ROM file, so only
+the pages holding the vectors are read until the ROM is copied
+into the collection.
 roms_by_name is a dict from filenames to indices into roms
 all_patches is a list of (rompath, bank, address, data bytes) values
 """
@@ -582,7 +611,7 @@ all_patches is a list of (rompath, bank, address, data bytes) values
             t['rom'] = rompath = os.path.normpath(relpathjoin(basepath, t['rom']))
             if rompath not in loaded_roms:
                 try:
-                    romdata = load_ines(rompath)
+                    romdata = load_ines(rompath, use_mmap=True)
                     get_entrypoint(romdata)
                     romdata['prgunused'] = [set() for i in romdata['base']]
                     pad_nrom128(romdata)
@@ -636,6 +665,8 @@ all_patches is a list of (rompath, bank, address, data bytes) values
 
             titles.append(t)
             # printable, or ignorable
+            if not trace_parser:
+                continue
             lines.extend(("", t['title']))
             t = sorted((k, v) for (k, v) in t.items() if k != 'title')
             lines.extend("  %s: %s" % row for row in t)
@@ -739,32 +770,40 @@ def roms_to_banks(roms, start_bank=0):
 roms is an iterable of 2-tuples (filename, romdict) where romdict is
 a dictionary with keys "prg", "chr", and "prgunused".
 
-Return a 4-tuple (prgbanks, chrbanks, prg_starts, chr_starts).
-prgbanks is [(bytearray of 32768 bytes, set of unused slices), ...]
+Return a 5-tuple (prgbanks, chrbanks, prg_starts, chr_starts, chr_lengths).
+prgbanks is [(32768 bytes, set of unused slices), ...], where the bytes
+are a read-only memoryview of the ROM's PRG ROM, to be copied into a
+RomImage
 chrbanks is just an array of 8-bit strings
 prg_starts and chr_starts are arrays from indices into roms to
 indices into prgbanks and chrbanks respectively
+chr_lengths is the number of CHR banks in each ROM
+
+If a ROM's CHR ROM is identical to that of an earlier ROM, such as
+another revision of the same game, its chr_starts entry points at
+the earlier ROM's banks instead of adding them again.
 """
-    prgbanks = [(create_blank_prg_bank(), [(0xFFF0, 0xFFFA)])
+    prgbanks = [(blank_bank, [(0xFFF0, 0xFFFA)])
                 for i in range(start_bank)]
     chrbanks = []
     prg_starts = []
     chr_starts = []
     chr_lengths = []
+    chr_starts_by_digest = {}
     lines = []
 
     # At this point, split GNROMs into PRG banks, pad each NROM-128
     # to 32 KiB, and split CNROMs and GNROMs into CHR banks
     for (filename, romdata) in roms:
         prg_starts.append(len(prgbanks))
-        chr_starts.append(len(chrbanks))
         prgunused = romdata['prgunused']
+        prgview = memoryview(romdata['prg']).toreadonly()
         lines.append("Adding %s" % filename)
 
         # Get all 32K banks from the PRG ROM
         for i, unused_ranges in enumerate(prgunused):
             byte_offset = i * 0x8000
-            prgbytes = bytearray(romdata['prg'][byte_offset:byte_offset + 0x8000])
+            prgbytes = prgview[byte_offset:byte_offset + 0x8000]
 
             # TO DO: Allow larger ROM
             assert len(prgbytes) == 32768
@@ -773,13 +812,24 @@ indices into prgbanks and chrbanks respectively
             prgbanks.append((prgbytes, unused_ranges))
 
         number_of_chr_banks = 0
-        if 'chr' in romdata:
+        chr_digest = hashlib.sha256(romdata.get('chr', b'')).digest()
+        if 'chr' in romdata and chr_digest in chr_starts_by_digest:
+            chr_starts.append(chr_starts_by_digest[chr_digest])
+            number_of_chr_banks = len(romdata['chr']) // 0x2000
+            lines.append("  CHR banks $%02x-$%02x (same as an earlier ROM)"
+                         % (chr_starts[-1],
+                            chr_starts[-1] + number_of_chr_banks - 1))
+        elif 'chr' in romdata:
+            chr_starts.append(len(chrbanks))
+            chr_starts_by_digest[chr_digest] = len(chrbanks)
             for byte_offset in range(0, len(romdata['chr']), 0x2000):
-                chrdata = romdata['chr'][byte_offset:byte_offset + 0x2000]
+                chrdata = bytes(romdata['chr'][byte_offset:byte_offset + 0x2000])
                 assert len(chrdata) == 8192
                 lines.append("  CHR bank $%02x" % (len(chrbanks),))
                 chrbanks.append(chrdata)
                 number_of_chr_banks += 1
+        else:
+            chr_starts.append(len(chrbanks))
         chr_lengths.append(number_of_chr_banks)
 
     if trace:
@@ -794,6 +844,31 @@ assert len(blank_bank) == 32768
 
 # Graphics data #####################################################
 
+# Size of a screenshot's header and uncompressed tiles: 13 bytes of
+# palette and attributes, then 8 by 7 tiles of 24 bytes
+SCREENSHOT_RAW_SIZE = 13 + 56 * 24
+SCREENSHOT_HEADER_SIZE = 13
+# Each 4 tiles are a background block and a foreground block
+SCREENSHOT_DONUT_BLOCKS = 56 // 4 * 2
+
+# Bump this when changing how images are converted to tiles, so
+# that the build cache doesn't return stale conversions
+IMAGE_CONVERSION_VERSION = 1
+
+def image_cache_key(cache, kind, filename, *options):
+    """Make a build cache key from an image file's contents and options."""
+    with open(filename, 'rb') as infp:
+        imdata = infp.read()
+    return cache.make_key(kind, str(IMAGE_CONVERSION_VERSION),
+                          donut_codec_id, *options, imdata)
+
+def cached_bmptosb53(infilename, palette, cache, max_tiles=256):
+    """Convert an image to an sb53, reusing a cached conversion."""
+    key = image_cache_key(cache, 'sb53', infilename,
+                          bytes(palette), str(max_tiles))
+    return cache.get_or_compute(key, bmptosb53,
+                                infilename, palette, max_tiles)
+
 def bmptosb53(infilename, palette, max_tiles=256, trace=False):
     """Convert an image to an sb53."""
     import savtool
@@ -858,19 +933,44 @@ def load_screenshot(filename, palette=None):
     header, tiledata = S.form_screenshot(tiles01, tiles2, attrs, palette)
     return header, tiledata
 
-def load_screenshots(titles, basepath=None):
+def load_compressed_screenshot(filename, palette=None,
+                               cycle_limit=donutlib.DEFAULT_CYCLE_LIMIT):
+    """Load a screenshot and return its header and compressed tile data."""
+    headerdata, tiledata = load_screenshot(filename, palette)
+    return headerdata + compress_screenshot_tiledata(tiledata, cycle_limit)
+
+def load_screenshots(titles, basepath=None, cache=None, jobs=1,
+                     cycle_limit=donutlib.DEFAULT_CYCLE_LIMIT):
     """Load and compress all titles' screenshots.
 
 This function takes a list of dictionaries with element 'screenshot',
 loads the images using PIL, maps the screenshots to the NES color
 palette, converts them to tiles, and compresses the tiles.
+If cache is a BuildCache, unchanged images are taken from the cache,
+keyed by the image file's bytes.  Images not in the cache are
+converted by up to jobs processes.  cycle_limit is the most CPU
+cycles that the menu may spend decoding each 64-byte Donut block.
 
 Return (screenshots, screenshots_by_titleno).
 screenshots is [(pb53_bytes, [color1, color2, color3]), ...]
 screenshot_ids is a list of one index into screenshots for each title
 
 """
-    screenshots = []
+    cache = cache or BuildCache()
+    (filenames, screenshot_ids) = screenshot_filenames(titles, basepath)
+    keys = screenshot_keys(cache, filenames, cycle_limit)
+    load_fn = functools.partial(load_compressed_screenshot,
+                                cycle_limit=cycle_limit)
+    screenshots = cached_map(cache, keys, load_fn, filenames, jobs)
+    return (screenshots, screenshot_ids)
+
+def screenshot_filenames(titles, basepath=None):
+    """Number unique screenshots in order of first use.
+
+Return (filenames, screenshot_ids), where screenshot_ids is a list of
+one index into filenames for each title.
+"""
+    filenames = []
     screenshots_by_name = {}
     screenshot_ids = []
     for d in titles:
@@ -879,56 +979,106 @@ screenshot_ids is a list of one index into screenshots for each title
         try:
             scrid = screenshots_by_name[filename]
         except KeyError:
-            headerdata, tiledata = load_screenshot(filename)
-            scrid = len(screenshots)
-            ctiledata = compress_screenshot_tiledata(tiledata)
-            screenshots.append(headerdata+ctiledata)
-            screenshots_by_name[filename] = scrid
+            scrid = screenshots_by_name[filename] = len(filenames)
+            filenames.append(filename)
         screenshot_ids.append(scrid)
-    return (screenshots, screenshot_ids)
+    return (filenames, screenshot_ids)
+
+def screenshot_keys(cache, filenames,
+                    cycle_limit=donutlib.DEFAULT_CYCLE_LIMIT):
+    """Make build cache keys for compressed screenshots."""
+    return [image_cache_key(cache, 'screenshot', filename,
+                            'cycles=%d' % cycle_limit)
+            for filename in filenames]
+
+def format_scrdir(scr_directory):
+    """Format (bank, address) tuples as a screenshot directory."""
+    return b''.join(bytes([
+        bank & 0xFF, addr & 0xFF, addr >> 8
+    ]) for (bank, addr) in scr_directory)
+
+def cached_map(cache, keys, fn, inputs, jobs=1):
+    """Return [fn(x) for x in inputs], reusing results in the build cache.
+
+cache -- a BuildCache
+keys -- one cache key for each element of inputs
+fn -- a module-level function, or functools.partial of one, taking
+    one element of inputs and returning a byte string
+jobs -- number of worker processes to run fn on inputs missing from
+    the cache; if 1, run fn in this process
 
-def neg_len_x_1_0(x):
-    return -len(x[1][0])
+The results are in the same order as inputs no matter how many
+jobs are used.
+"""
+    results = [cache.get(key) for key in keys]
+    misses = [i for i, result in enumerate(results) if result is None]
+    misses_inputs = [inputs[i] for i in misses]
+    if jobs > 1 and len(misses) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        # Workers send back their Donut block cache counters too
+        counting_fn = functools.partial(donutlib.call_counting_blocks, fn)
+        with ProcessPoolExecutor(min(jobs, len(misses))) as executor:
+            misses_results = []
+            for result, counts in executor.map(counting_fn, misses_inputs):
+                donutlib.add_block_cache_counts(counts)
+                misses_results.append(result)
+    else:
+        misses_results = [fn(x) for x in misses_inputs]
+    for i, result in zip(misses, misses_results):
+        results[i] = result
+        if result:  # don't cache an encoder that failed silently
+            cache.put(keys[i], result)
+    return results
 
-def insert_screenshots(titles, prgbanks, basepath=None):
-    """Load screenshots and insert them into unused space.
+def compress_chr_banks(chrbanks, cache, jobs=1,
+                       cycle_limit=donutlib.DEFAULT_CYCLE_LIMIT):
+    """Compress CHR banks with donut_compress(), reusing cached results.
 
-Return a tuple (scrdir, screenshot_ids).
-scrdir is a byte string with 3 bytes per entry:
-bank, address low, address high
-screenshot_ids is a list of scrdir entries, one for each title.
-If i = screenshot_ids[titleno], then the title's entry is
-scrdir[i * 3:i * 3 + 3].
+chrbanks -- a list of 8192-byte BLOs
+cache -- a BuildCache
+jobs -- number of worker processes, as in cached_map()
+cycle_limit -- most CPU cycles to decode each 64-byte block
 
+Return a list of compressed banks in the same order as chrbanks.
 """
-    # Load screenshots
-    (screenshots, screenshot_ids) = load_screenshots(titles, basepath)
-
-    # Insert screenshots into unused PRG ROM
-    scr_sorted = sorted(enumerate(screenshots), key=lambda x: -len(x[1]))
-    scr_directory = [None for i in screenshots]
-    for (i, d) in scr_sorted:
-        scr_directory[i] = ffd_add(prgbanks, d)
-    if trace:
-        print("%d screenshots totaling %d compressed bytes plus %d for the directory"
-              % (len(screenshots),
-                 sum(len(d) for d in screenshots),
-                 len(scr_directory)))
+    keys = chr_bank_keys(cache, chrbanks, cycle_limit)
+    compress_fn = functools.partial(donut_compress, cycle_limit=cycle_limit)
+    return cached_map(cache, keys, compress_fn, chrbanks, jobs)
 
-    # Format screenshot directory
-    scrdir = b''.join(bytes([
-        bank & 0xFF, addr & 0xFF, addr >> 8
-    ]) for (bank, addr) in scr_directory)
-    return (scrdir, screenshot_ids)
+def chr_bank_keys(cache, chrbanks, cycle_limit=donutlib.DEFAULT_CYCLE_LIMIT):
+    """Make build cache keys for compressed CHR banks."""
+    return [cache.make_key('chr', donut_codec_id, 'bit-flip',
+                           'cycles=%d' % cycle_limit, data)
+            for data in chrbanks]
 
-def insert_chr(chrbanks, prgbanks):
-    """Compress and insert the CHR banks into unused PRG ROM.
+def dedup_chr_banks(chrbanks):
+    """Find identical CHR banks so that each is compressed and stored once.
 
-chrbanks -- a list of 8192-byte BLOs
-prgbanks -- a list of PRG banks as used by ffd_add
+Return (unique_banks, chr_ids), where unique_banks lists each distinct
+bank in order of first use, and unique_banks[chr_ids[i]] == chrbanks[i].
+"""
+    unique_banks = []
+    ids_by_data = {}
+    chr_ids = []
+    for data in chrbanks:
+        try:
+            chr_id = ids_by_data[data]
+        except KeyError:
+            chr_id = ids_by_data[data] = len(unique_banks)
+            unique_banks.append(data)
+        chr_ids.append(chr_id)
+    if trace and len(unique_banks) < len(chrbanks):
+        print("%d CHR banks, of which %d are unique"
+              % (len(chrbanks), len(unique_banks)))
+    return (unique_banks, chr_ids)
+
+def format_chrdir(chr_directory, cchrbanks):
+    """Format placements of compressed CHR banks as a CHR directory.
+
+chr_directory -- a (bank, address) tuple for each compressed bank
+cchrbanks -- the compressed banks
 
-Return a byte string representing a directory of the compressed
-CHR ROM, whose entries in the following format:
+Return a byte string with 5 bytes per entry in the following format:
 
 00: PRG bank
 01-02: Address (little endian)
@@ -941,42 +1091,191 @@ copies tiles from the first.  The first starts from Address, the
 second from (Address + Midpoint).
 
 """
-    def compress_segments(data):
-        cdata = donut_compress(data)
-        return (cdata, [len(cdata)])
-
-    total_unco = sum(len(c) for c in chrbanks)
-    pb53banks = [compress_segments(c) for c in chrbanks]
-    del chrbanks
-
-    # Insert the CHR banks
-    pb53banks_sorted = sorted(enumerate(pb53banks), key=neg_len_x_1_0)
-    if False:
-        print("Compressed %d CHR bytes to %d"
-              % (total_unco,
-                 sum(len(c) + 4 for (c, sp) in pb53banks)))
-        print("\n".join("CHR bank $%02x:%5d bytes" % (i, len(d))
-                        for (i, (d, mp)) in pb53banks_sorted))
-    chr_directory = [None for i in pb53banks]
-    for (i, (data, midpoint)) in pb53banks_sorted:
-        chr_directory[i] = ffd_add(prgbanks, data) + tuple(midpoint)
-    chrdir = b''.join(bytes([
-        b & 0xFF, a & 0xFF, a >> 8, mp & 0xFF, mp >> 8
-    ]) for (b, a, mp) in chr_directory)
-    # At this point, chr_directory[] is a list of
-    # (bank, address, midpoint) tuples, one for each CHR ROM bank
-    # and chrdir is the NES-readable version of that
-
+    # The midpoint is the whole length, as Donut banks don't
+    # reference the first half
+    chr_directory = [(b, a, len(data))
+                     for ((b, a), data) in zip(chr_directory, cchrbanks)]
     if trace:
         print("CHR directory:")
         print("\n".join("CHR bank $%02x in PRG bank $%02x address $%02x"
                         % (i, b, a)
                         for (i, (b, a, m)) in enumerate(chr_directory)))
-    return chrdir
+    return b''.join(bytes([
+        b & 0xFF, a & 0xFF, a >> 8, mp & 0xFF, mp >> 8
+    ]) for (b, a, mp) in chr_directory)
+
+def verify_compressed_data(prg, chr_digests, scr_digests):
+    """Decompress every CHR bank and screenshot in a built ROM.
+
+prg -- the PRG ROM, with its key block and directories in place
+chr_digests -- SHA-256 digest of each CHR bank, in CHR directory order
+scr_digests -- (length, SHA-256 digest) of each compressed screenshot,
+    in screenshot directory order
+
+CHR banks are decompressed and compared to the banks that went in.
+A screenshot's compressed bytes must be the ones that went in and
+decompress to the right number of blocks using all of those bytes.
+
+Return a list of problems, empty if there are none.
+"""
+    kb = parse_key_block(prg)
+    final_bank = prg[-0x8000:]
+    problems = []
+
+    def rom_slice(bank, address):
+        return prg[bank * 0x8000 + address - 0x8000:(bank + 1) * 0x8000]
+
+    chrdir = final_bank[kb['chrdir'] - 0x8000:]
+    for (i, digest) in enumerate(chr_digests):
+        entry = chrdir[i * 5:i * 5 + 5]
+        bank, address, length = (entry[0], entry[1] | (entry[2] << 8),
+                                  entry[3] | (entry[4] << 8))
+        where = "CHR bank %d at %d:%04X" % (i, bank, address)
+        try:
+            data, used = donut.decompress_blocks(rom_slice(bank, address), 128)
+        except ValueError as e:
+            problems.append("%s: %s" % (where, e))
+            continue
+        if used != length:
+            problems.append("%s: %d bytes long, expected %d"
+                            % (where, used, length))
+        elif hashlib.sha256(data).digest() != digest:
+            problems.append("%s: decompressed data differs" % where)
+
+    scrdir = final_bank[kb['scrdir'] - 0x8000:]
+    for (i, (length, digest)) in enumerate(scr_digests):
+        bank, address = scrdir[i * 3], scrdir[i * 3 + 1] | (scrdir[i * 3 + 2] << 8)
+        where = "screenshot %d at %d:%04X" % (i, bank, address)
+        data = rom_slice(bank, address)[:length]
+        if hashlib.sha256(data).digest() != digest:
+            problems.append("%s: data differs" % where)
+            continue
+        try:
+            used = donut.decompress_blocks(data[SCREENSHOT_HEADER_SIZE:],
+                                           SCREENSHOT_DONUT_BLOCKS)[1]
+        except ValueError as e:
+            problems.append("%s: %s" % (where, e))
+            continue
+        if used != length - SCREENSHOT_HEADER_SIZE:
+            problems.append("%s: tiles are %d bytes, expected %d"
+                            % (where, used, length - SCREENSHOT_HEADER_SIZE))
+    return problems
+
+def plan_with_padding(prgbanks, groups, packer='ffd', time_budget=10.0):
+    """Plan where to insert groups of byte strings, adding banks if needed.
+
+If groups don't fit in prgbanks, double the number of banks by
+inserting blank banks before the last (menu) bank and try again.
+The banks' data and slice lists are not changed.
+
+Return placements as binpack.pack() does.
+"""
+    groups_lens = [[len(data) for data in group] for group in groups]
+    while True:
+        try:
+            return binpack.packers[packer](binpack.copy_ranges(prgbanks),
+                                           groups_lens, time_budget)
+        except ValueError as e:
+            if len(prgbanks) >= 256:
+                raise ValueError("%s in 256 banks" % e)
+            print("Warning: data doesn't fit in %d PRG banks with %s packer (%s); adding banks"
+                  % (len(prgbanks), packer, e), file=sys.stderr)
+            prgbanks[-1:-1] = [blank_prg_source() for i in range(len(prgbanks))]
+
+def plan_incremental(prgbanks, groups, kinds, previous,
+                     packer='ffd', time_budget=10.0):
+    """Plan to put unchanged objects back where they were and pack the rest.
+
+groups -- lists of byte strings to insert
+kinds -- a manifest object kind for each group
+previous -- a BuildManifest of the previous build, or None
+
+If the rest don't fit around the unchanged objects, plan everything
+with plan_with_padding().  Return placements as binpack.pack() does.
+"""
+    if not previous:
+        return plan_with_padding(prgbanks, groups, packer, time_budget)
+
+    planning = binpack.copy_ranges(prgbanks)
+    placements = [[None] * len(group) for group in groups]
+    for (kind, group, group_placements) in zip(kinds, groups, placements):
+        for (i, data) in enumerate(group):
+            for (bank, address) in previous.placements(kind, data):
+                if (bank < len(planning)
+                    and binpack.reserve(planning[bank][1], address, len(data))):
+                    group_placements[i] = (bank, address)
+                    break
+    if trace:
+        print("Keeping %d of %d objects where they were in the previous build"
+              % (sum(p is not None for g in placements for p in g),
+                 sum(len(g) for g in groups)))
+
+    rest_lens = [[len(data) for (data, p) in zip(group, group_placements)
+                  if p is None]
+                 for (group, group_placements) in zip(groups, placements)]
+    try:
+        rest_placements = binpack.packers[packer](planning, rest_lens,
+                                                  time_budget)
+    except ValueError as e:
+        print("Warning: changed objects don't fit around unchanged ones (%s); repacking all"
+              % (e,), file=sys.stderr)
+        return plan_with_padding(prgbanks, groups, packer, time_budget)
+    for (group_placements, new_placements) in zip(placements, rest_placements):
+        new_placements = iter(new_placements)
+        for (i, p) in enumerate(group_placements):
+            if p is None:
+                group_placements[i] = next(new_placements)
+    return placements
+
+def print_packing_report(prgbanks, unpacked_banks, num_rom_banks, groups):
+    """Print how full each bank is and whether a smaller ROM would do.
+
+prgbanks -- PRG banks after packing
+unpacked_banks -- copy_ranges(prgbanks) from before packing
+num_rom_banks -- number of banks containing activities, which
+    can't be moved
+groups -- lists of byte strings that were packed
+
+"""
+    free_bytes = binpack.bank_free_bytes(prgbanks)
+    print("Unused bytes by bank:")
+    for (i, free) in enumerate(free_bytes):
+        print("Bank %3d: %5d" % (i, free))
+    print("Total unused: %d bytes in %d banks (%d KiB)"
+          % (sum(free_bytes), len(prgbanks), len(prgbanks) * 32))
+
+    # Could the collection fit in half as many banks?  Take the
+    # activities' banks as they were before packing, then blank banks,
+    # then the menu bank.
+    half = len(prgbanks) // 2
+    if num_rom_banks + 1 > half:
+        print("Can't shrink to %d KiB: activities use %d banks and the menu 1"
+              % (half * 32, num_rom_banks))
+        return
+    smaller = (unpacked_banks[:num_rom_banks]
+               + [ffd_prg_factory() for i in range(half - num_rom_banks - 1)]
+               + unpacked_banks[-1:])
+    needed = sum(len(data) for group in groups for data in group)
+    available = sum(binpack.bank_free_bytes(smaller))
+    if needed > available:
+        print("Can't shrink to %d KiB: %d bytes of data but only %d free"
+              % (half * 32, needed, available))
+        return
+    groups_lens = [[len(data) for data in group] for group in groups]
+    for packer in ('ffd', 'bfd'):
+        try:
+            binpack.packers[packer](smaller, groups_lens)
+        except ValueError:
+            continue
+        print("Could shrink to %d KiB with --packer %s"
+              % (half * 32, packer))
+        return
+    print("%d KiB has room for %d bytes of data in %d free; try --packer exhaustive"
+          % (half * 32, needed, available))
 
 # Directory serialization ###########################################
 
-def make_rom_directory(prg_starts, prg_lengths, unpatch_info, chr_starts, chr_total):
+def make_rom_directory(prg_starts, prg_lengths, unpatch_info, chr_starts, chr_lengths):
     """Turn an unpatch list into a ROM directory.
 
 prg_starts is the index of the first PRG bank for each rom
@@ -986,7 +1285,7 @@ before padding) from NROM-256 (32768 bytes and was not padded).
 unpatch_info is a list of tuples, one for each bank:
 (original reset vector, unpatch data)
 chr_starts is the index of the first CHR bank for each ROM
-chr_total is the total number of CHR banks in the ROM
+chr_lengths is the number of CHR banks in each ROM
 
 Ordinarily, copylefted code and non-free code cannot be placed in the
 same executable file.  But if the executable file is structured as an
@@ -1035,8 +1334,6 @@ reset vector with the original one.
 """
     prg_starts = list(prg_starts)
     prg_starts.append(len(unpatch_info))
-    chr_starts = list(chr_starts)
-    chr_starts.append(chr_total)
     prg_lengths = [n // 16384 for n in prg_lengths]
     romdir = bytearray()
     if trace:
@@ -1056,7 +1353,7 @@ reset vector with the original one.
         prg_num_banks = (prg_num_halfbanks + 1) // 2
         romdir.append(prg_num_halfbanks)
         chr_start_bank = chr_starts[i]
-        chr_num_banks = chr_starts[i + 1] - chr_start_bank
+        chr_num_banks = chr_lengths[i]
         romdir.append(chr_num_banks)
         for j in range(prg_start_bank, prg_start_bank + prg_num_banks):
             (orig_fffc, unpatch_data) = unpatch_info[j]
@@ -1081,20 +1378,26 @@ reset vector with the original one.
 def ffd_prg_factory():
     return (bytearray(blank_bank), [(0x8000, 0xFFF0)])
 
-def pad_to_pow2m1(prgbanks):
+def blank_prg_source():
+    """Make a read-only blank PRG bank to be copied into a RomImage."""
+    return (blank_bank, [(0x8000, 0xFFF0)])
+
+def pad_to_pow2m1(prgbanks, bank_factory=ffd_prg_factory):
     """Add blank PRG banks until reaching one less than a power of two."""
 
     # In binary, if (x & (x + 1)) is zero, then x is one less than
     # a power of two.
     while (len(prgbanks) & (len(prgbanks) + 1)) != 0:
-        prgbanks.append(ffd_prg_factory())
+        prgbanks.append(bank_factory())
 
-def pad_n_banks(prgbanks, n):
-    for i in range(n):
-        prgbanks.append(ffd_prg_factory())
+def descriptions_key(titles):
+    """Make a build cache key for the DTE-compressed descriptions."""
+    return dte_cache_key([t['description'].encode('action53') for t in titles],
+                         mincodeunit=DTE_MIN_CODEUNIT)
 
 def make_title_directory(titles, roms_by_name,
-                         prg_starts, chr_starts, chr_lengths, screenshot_ids):
+                         prg_starts, chr_starts, chr_lengths, screenshot_ids,
+                         cache=None):
     """Make a machine-readable directory of ROM titles.
 
 On the screen it is printed thus:
@@ -1133,8 +1436,12 @@ total of 32752 bytes.  In a 53-game collection, this limits the
 descriptions to average a bit over half a kilobyte each, which is
 fine considering 16 lines of VWF with about 28 characters per line.
 
-Return a tuple of three 8-bit byte strings: the title directory,
-the name block, and the description block.
+If cache is a BuildCache, reuse DTE-compressed descriptions from a
+build with the same descriptions.  A ManifestCache also finds them
+in the previous build.
+
+Return a tuple of four 8-bit byte strings: the title directory,
+the name block, the description block, and the DTE table.
 
 """
     # convert each title's PRG and CHR bank numbers from ROM-relative
@@ -1199,12 +1506,9 @@ the name block, and the description block.
         ]
         titledir.extend(titledir_data)
 
-    # TODO: Compress descriptions with DTE
-    if trace:
-        print("Compressing descriptions with DTE")
-        olddescsize = len(descriptions) + sum(len(x) for x in descriptions)
-    descriptions, replacements, _ = dte_compress(
-        descriptions, mincodeunit=DTE_MIN_CODEUNIT
+    olddescsize = len(descriptions) + sum(len(x) for x in descriptions)
+    descriptions, replacements, _ = dte_compress_cached(
+        descriptions, cache, mincodeunit=DTE_MIN_CODEUNIT
     )
 
     desc_block = bytearray()
@@ -1248,12 +1552,99 @@ def convert_title_lines(title_lines):
     out.append(b'\xFF')
     return b''.join(out)
 
+def parse_argv(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Builds an Action 53 multicart.")
+    parser.add_argument("cfgfile", help="collection config file (a53.cfg)")
+    parser.add_argument("outfile", help="name of .nes file to write")
+    parser.add_argument("--cache-dir", default=default_cache_dir(),
+                        help="directory of cached compressed data (default: %(default)s)")
+    parser.add_argument("--no-cache", dest="cache", action="store_false",
+                        help="compress everything instead of using the cache")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="compress with up to JOBS processes"
+                        " (default 1; 0 means one per CPU)")
+    parser.add_argument("--packer", choices=sorted(binpack.packers),
+                        default="ffd",
+                        help="how to fit CHR ROM, screenshots, and descriptions"
+                        " into unused PRG ROM (default: %(default)s)")
+    parser.add_argument("--pack-time", type=float, default=10.0,
+                        metavar="SECONDS",
+                        help="time limit for --packer exhaustive"
+                        " (default: %(default)s)")
+    parser.add_argument("--stats", metavar="FILE",
+                        help="write time and memory use of each phase and"
+                        " sizes of compressed data as JSON to FILE"
+                        " ('-' for standard output, which moves the build"
+                        " log to standard error); if --incremental finds"
+                        " nothing changed, only up_to_date and the previous"
+                        " build's ROM sizes")
+    parser.add_argument("--incremental", action="store_true",
+                        help="reuse unchanged data and placements from the"
+                        " previous build of outfile, per outfile.manifest")
+    parser.add_argument("--no-verify", dest="verify", action="store_false",
+                        help="don't decompress CHR ROM and screenshots"
+                        " in the finished ROM to check them")
+    parser.add_argument("--donut-cycle-limit", type=int,
+                        default=donutlib.DEFAULT_CYCLE_LIMIT, metavar="CYCLES",
+                        help="most CPU cycles the menu may spend decoding"
+                        " each 64-byte block of CHR ROM or screenshot tiles"
+                        " (default: %%(default)s; at least %d)"
+                        % donut.MIN_CYCLE_LIMIT)
+    args = parser.parse_args(argv[1:])
+    if args.donut_cycle_limit < donut.MIN_CYCLE_LIMIT:
+        parser.error("--donut-cycle-limit must be at least %d"
+                     % donut.MIN_CYCLE_LIMIT)
+    if args.jobs < 1:
+        args.jobs = os.cpu_count() or 1
+    return args
+
 def main(argv=None):
-    argv = argv or sys.argv
+    args = parse_argv(argv or sys.argv)
+    stats = BuildStats()
+    if args.stats == '-':
+        # Keep standard output for the JSON alone
+        with contextlib.redirect_stdout(sys.stderr):
+            build(args, stats)
+    else:
+        build(args, stats)
+    if args.stats:
+        stats.save(args.stats)
+
+def build(args, stats):
+    """Build the collection that args from parse_argv() describe.
+
+stats -- a BuildStats to which to add time, memory, and sizes
+"""
+    stats.begin('config')
+    cfgfilename, outfilename = args.cfgfile, args.outfile
+    manifest_filename = outfilename + '.manifest'
+    manifest = BuildManifest({
+        'cfgfile': os.path.abspath(cfgfilename), 'codec': donut_codec_id,
+        'packer': args.packer, 'pack_time': args.pack_time,
+        'donut_cycle_limit': args.donut_cycle_limit,
+    })
+
+    # See what changed since the previous build
+    previous = None
+    if args.incremental:
+        previous = BuildManifest.load(manifest_filename, outfilename)
+    if previous:
+        changed = previous.changed_inputs()
+        if previous.options != manifest.options:
+            changed.append("build options")
+        if not changed:
+            print("%s is up to date" % outfilename)
+            stats.set('up_to_date', True)
+            for (name, value) in previous.sizes.items():
+                stats.set(name, value)
+            return
+        print("Changed since previous build: %s" % ", ".join(changed))
+    cache = ManifestCache(args.cache_dir if args.cache else None, previous)
 
     # Load the config file
-    cfgfilename, outfilename = argv[1:3]
     parsed = RomsetParser(filenames=[cfgfilename])
+    manifest.add_input(cfgfilename)
 
     if not parsed.pages:
         raise IndexError("%s: no pages" % (cfgfilename,))
@@ -1261,16 +1652,23 @@ def main(argv=None):
     a53charset.register()  # Make 'action53' encoding available
 
     # Convert the title screen
-    title_screen_sb53 = bmptosb53(parsed.title_screen, parsed.title_palette)
+    stats.begin('title screen')
+    title_screen_sb53 = cached_bmptosb53(parsed.title_screen,
+                                         parsed.title_palette, cache)
+    manifest.add_input(parsed.title_screen)
 
     # Convert the title lines
     print(parsed.title_lines)
     title_lines_data = convert_title_lines(parsed.title_lines)
 
     # Load the ROMs
+    stats.begin('rom load')
     start_bank = parsed.start_bank
     (pages, titles, roms, roms_by_name, cfg_patches) \
             = load_page_roms(parsed.pages, cfgfilename)
+    for (pagename, titles_on_page) in parsed.pages:
+        for t in titles_on_page:
+            manifest.add_input(t['rom'])
     if len(titles) == 0:
         raise IndexError("Not writing ROM: no titles were loaded")
     if trace:
@@ -1278,6 +1676,7 @@ def main(argv=None):
               % (len(titles), len(roms), len(pages)))
     with open(parsed.menu_prg, 'rb') as infp:
         final_bank = bytearray(infp.read())
+    manifest.add_input(parsed.menu_prg)
     if len(final_bank) != 32768:
         raise ValueError("%s: %s should be 32768 bytes, not %d"
                          % (cfgfilename, parsed.menu_prg, len(final_bank)))
@@ -1292,18 +1691,20 @@ def main(argv=None):
         print("start_bank is %s" % start_bank)
     mapperNumber, submapperNumber = 28, 0
     skip_full = mapperNumber == 28
+    stats.begin('exit patches')
     exit_patches = get_exit_patches(titles, roms, skip_full)
     if trace:
         print("%d exit patches, %d cfg patches"
               % (len(exit_patches), len(cfg_patches)))
 
+    stats.begin('roms_to_banks')
     (prgbanks, chrbanks, prg_starts, chr_starts, chr_lengths) \
                = roms_to_banks(roms, start_bank)
     roms = [rom[0] for rom in roms]
+    num_rom_banks = len(prgbanks)
     if trace:
-        print("ROM size before adding CHR: %d PRG banks" % len(prgbanks))
-    pad_to_pow2m1(prgbanks)
-#    pad_n_banks(prgbanks, 192)
+        print("ROM size before adding CHR: %d PRG banks" % num_rom_banks)
+    pad_to_pow2m1(prgbanks, blank_prg_source)
     if trace:
         print("padded to power of 2: %d PRG banks" % len(prgbanks))
 
@@ -1326,7 +1727,7 @@ def main(argv=None):
 
     # Create those directories that don't depend on other directories
     romdir = make_rom_directory(prg_starts, prg_lengths, unpatch_info,
-                                chr_starts, len(chrbanks))
+                                chr_starts, chr_lengths)
     pagedir = make_pagedir(pages)
 
     # Estimate size of other last-bank directories to be inserted
@@ -1339,7 +1740,62 @@ def main(argv=None):
                           for d in titles)
                     + len(title_screen_sb53))
 
+    # Compress tile data for CHR ROM and screenshots
+    # Identical CHR banks share one compressed copy
+    stats.begin('chr')
+    (unique_chr, chr_ids) = dedup_chr_banks(chrbanks)
+    chr_keys = chr_bank_keys(cache, unique_chr, args.donut_cycle_limit)
+    cchrbanks = compress_chr_banks(unique_chr, cache, args.jobs,
+                                   args.donut_cycle_limit)
+    stats.add_objects('chr', len(chrbanks) * 8192,
+                      sum(len(d) for d in cchrbanks), len(chrbanks))
+    stats.set('unique_chr_banks', len(unique_chr))
+    chr_digests = [hashlib.sha256(data).digest() for data in unique_chr]
+    del chrbanks, unique_chr
+    stats.begin('screenshots')
+    scr_filenames = screenshot_filenames(titles, cfgfilename)[0]
+    for filename in scr_filenames:
+        manifest.add_input(filename)
+    scr_keys = screenshot_keys(cache, scr_filenames, args.donut_cycle_limit)
+    (screenshots, screenshot_ids) = load_screenshots(titles, cfgfilename,
+                                                     cache, args.jobs,
+                                                     args.donut_cycle_limit)
+    stats.add_objects('screenshot', len(screenshots) * SCREENSHOT_RAW_SIZE,
+                      sum(len(d) for d in screenshots), len(screenshots))
+
+    # Create the title directory
+    stats.begin('dte')
+    (titledir, name_block, desc_block, dte_replacements) \
+               = make_title_directory(titles, roms_by_name,
+                                      prg_starts, chr_starts, chr_lengths, screenshot_ids,
+                                      cache)
+    pagedir_sz = sum(len(p[0]) for p in pages) + 2 * len(pages) + 1
+    assert len(pagedir) == pagedir_sz
+    stats.add_objects('descriptions',
+                      sum(len(t['description'].encode('action53')) + 1
+                          for t in titles),
+                      len(desc_block) + len(dte_replacements), len(titles))
+
+    # Plan where to insert tile data and descriptions into unused
+    # PRG ROM, which may add banks
+    stats.begin('directory layout')
+    groups = [cchrbanks, screenshots, [desc_block]]
+    unpacked_banks = binpack.copy_ranges(prgbanks)
+    placements = plan_incremental(prgbanks, groups,
+                                  ('chr', 'screenshot', 'desc_block'),
+                                  previous, args.packer, args.pack_time)
+    (chr_directory, scr_directory, (desc_block_addr,)) = placements
+    del previous
+
+    # Now that the size is known, copy all banks into the output
+    stats.begin('roms_to_banks')
+    image = RomImage(outfilename, len(prgbanks))
+    prgbanks = image.load_banks(prgbanks)
+    final_banks = prgbanks[-1:]
+    final_bank = final_banks[0][0]
+
     # Apply binary patches in the cfg (as opposed to reset patches)
+    stats.begin('exit patches')
     all_patches = []
     all_patches.extend(exit_patches)
     all_patches.extend(cfg_patches)
@@ -1350,17 +1806,27 @@ def main(argv=None):
         prgbank[offset:offset + len(data)] = data
     del prgbank, all_patches, cfg_patches, exit_patches
 
-    # Insert tile data for CHR ROM and screenshots
-    chrdir = insert_chr(chrbanks, prgbanks)
-    del chrbanks
-    (scrdir, screenshot_ids) = insert_screenshots(titles, prgbanks, cfgfilename)
-
-    # Create the title directory
-    (titledir, name_block, desc_block, dte_replacements) \
-               = make_title_directory(titles, roms_by_name,
-                                      prg_starts, chr_starts, chr_lengths, screenshot_ids)
-    pagedir_sz = sum(len(p[0]) for p in pages) + 2 * len(pages) + 1
-    assert len(pagedir) == pagedir_sz
+    stats.begin('directory layout')
+    binpack.write_plan(prgbanks, groups, placements)
+    chrdir = format_chrdir([chr_directory[i] for i in chr_ids],
+                           [cchrbanks[i] for i in chr_ids])
+    scrdir = format_scrdir(scr_directory)
+    if trace:
+        print("%d screenshots totaling %d compressed bytes plus %d for the directory"
+              % (len(screenshots),
+                 sum(len(d) for d in screenshots),
+                 len(scr_directory)))
+        print_packing_report(prgbanks, unpacked_banks, num_rom_banks, groups)
+    del unpacked_banks, groups
+
+    # Record where compressed objects went
+    for (key, data, (bank, addr)) in zip(chr_keys, cchrbanks, chr_directory):
+        manifest.add_object('chr', key, data, [(bank, addr, len(data))], 8192)
+    for (key, data, (bank, addr)) in zip(scr_keys, screenshots, scr_directory):
+        manifest.add_object('screenshot', key, data, [(bank, addr, len(data))])
+    scr_digests = [(len(data), hashlib.sha256(data).digest())
+                   for data in screenshots]
+    del cchrbanks, screenshots
 
     # Save the ROM directory, CHR directory, screenshot directory,
     # title directory, and name block to the menu bank
@@ -1379,23 +1845,18 @@ def main(argv=None):
         raise ValueError("internal error: directory size of %d bytes does not match estimate of %d"
                          % (dirs_len2, est_dirs_len))
 
-
-
-    desc_block_addr = ffd_add(prgbanks, desc_block)
-
+    stats.begin('checksums')
     checksums_dir = bytearray()
     for bank in prgbanks:
-        checksum = crc16xmodem.crc16xmodem(bank[0][0x0000:0x4000])
-        checksums_dir.append(checksum >> 8)
-        checksums_dir.append(checksum & 0xff)
-        checksum = crc16xmodem.crc16xmodem(bank[0][0x4000:0x8000])
-        checksums_dir.append(checksum >> 8)
-        checksums_dir.append(checksum & 0xff)
+        for checksum in crc16xmodem.crc16xmodem_blocks(bank[0], 0x4000):
+            checksums_dir.append(checksum >> 8)
+            checksums_dir.append(checksum & 0xff)
     # we'll put the database checksum at the end of it's 16KiB bank
     # causing a checksum over the whole bank to acually be computed to 0.
     checksums_dir[-3] = 0
     checksums_dir[-4] = 0
 
+    stats.begin('directory layout')
     name_block_addr = ffd_add(final_banks, name_block)
     romdir_addr = ffd_add(final_banks, romdir)
     titledir_addr = ffd_add(final_banks, titledir)
@@ -1410,6 +1871,12 @@ def main(argv=None):
                         for s, e in final_banks[0][1]))
 
     title_strings_addr = ffd_add(final_banks, title_lines_data)
+    desc_part = desc_block_addr + (len(desc_block),)
+    manifest.add_object('descriptions', descriptions_key(titles),
+                        dte_replacements + desc_block,
+                        [(len(prgbanks) - 1, dte_replacements_addr[1],
+                          len(dte_replacements)), desc_part])
+    manifest.add_object('desc_block', None, desc_block, [desc_part])
     checksums_dir_addr = ffd_add(final_banks, checksums_dir)
 
     # Preadjust DTE table for indexing using Y register equal to
@@ -1457,6 +1924,7 @@ def main(argv=None):
               % (romdir_addr[1], romdir_addr[1] + len(romdir) - 1,
                  titledir_addr[1], titledir_addr[1] + len(titledir) - 1))
     final_bank[0x0000:0x0000 + len(keyblock)] = keyblock
+    stats.begin('checksums')
     db_checksum = crc16xmodem.crc16xmodem(final_bank[0x0000:0x3ffe])
     print("db_checksum $%04x" % db_checksum)
     final_bank[0x3ffe] = db_checksum >> 8
@@ -1471,6 +1939,7 @@ def main(argv=None):
                   % (i, ", ".join("%04x-%04x" % (s, e-1)
                                   for (s, e) in unused_ranges)))
 
+    stats.begin('write')
     iNES_prgbanks = len(prgbanks) * 2
     iNESheader = bytearray(b"NES\x1A")
 
@@ -1484,10 +1953,47 @@ def main(argv=None):
     iNESheader.append(0x09)  # 64 << 9 bytes of CHR RAM
     iNESheader.extend(bytes(16 - len(iNESheader)))
 
-    with open(outfilename, "wb") as outfp:
-        outfp.write(iNESheader)
-        outfp.writelines(b[0] for b in prgbanks)
-    
+    image.header[:] = iNESheader
+    if args.verify:
+        stats.begin('verify')
+        problems = verify_compressed_data(
+            image.view[16:], [chr_digests[i] for i in chr_ids], scr_digests
+        )
+        if problems:
+            print("\n".join(problems), file=sys.stderr)
+            raise ValueError("%s: %d problems in compressed data; not written"
+                             % (outfilename, len(problems)))
+        if trace:
+            print("Verified %d CHR banks and %d screenshots"
+                  % (len(chr_ids), len(scr_digests)))
+    stats.begin('write')
+    free_bytes = binpack.bank_free_bytes(prgbanks)
+    manifest.sizes = {
+        'prg_banks': len(free_bytes),
+        'unused_bytes': sum(free_bytes),
+        'last_bank_unused_bytes': free_bytes[-1],
+    }
+    manifest.save(manifest_filename, image.mm)
+    del prgbanks, final_banks, final_bank
+    image.commit()
+
+    if trace and cache.cache_dir:
+        print("Build cache %s: %d hits, %d misses"
+              % (cache.cache_dir, cache.hits, cache.misses))
+    if trace and cache.reused:
+        print("Reused %d objects from previous build" % cache.reused)
+    stats.begin('cache trim')
+    cache.trim()
+    stats.end()
+
+    if args.stats:
+        stats.set('up_to_date', False)
+        for (name, value) in manifest.sizes.items():
+            stats.set(name, value)
+        stats.set('cache', {'hits': cache.hits, 'misses': cache.misses,
+                            'reused': cache.reused})
+        stats.set('donut_block_cache', donutlib.block_cache_info())
+
 if __name__ == '__main__':
     in_IDLE = 'idlelib.__main__' in sys.modules or 'idlelib.run' in sys.modules
     if in_IDLE:
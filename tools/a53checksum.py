@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Verify the bank checksums of a built Action 53 collection
+Copyright 2026 Action 53 contributors
+zlib license
+
+a53build stores the CRC16 (XModem) of each 16 KiB half of each
+32 KiB PRG bank in a checksums directory in the last bank, which
+the menu uses to test the cart.  The address of the directory is
+in the key block at $8000 of the last bank.  The entry for the
+first half of the last bank is 0, as the database checksum at
+$BFFE makes the CRC of that half 0.
+
+This tool reads a .nes file, finds the checksums directory, and
+checks every bank, so that a cart image can be verified before
+it is flashed.
+"""
+import sys
+import argparse
+from crc16xmodem import crc16xmodem_blocks
+
+KEY_BLOCK_ID = b'\xa5A53'
+CHECKSUM_BLOCK_SIZE = 0x4000
+
+# Offsets of 16-bit addresses in the key block
+KEY_BLOCK_ADDRS = {
+    'chrdir': 8, 'scrdir': 10, 'titledir': 12, 'pagedir': 14,
+    'name_block': 16, 'desc_block': 18, 'title_screen': 22,
+    'title_strings': 24, 'dte': 26, 'checksums_dir': 28, 'romdir': 30,
+}
+
+def load_nes_prg(filename):
+    """Read the PRG ROM of an iNES file.
+
+Return a memoryview of the PRG ROM.
+"""
+    with open(filename, 'rb') as infp:
+        data = infp.read()
+    if data[:4] != b'NES\x1a':
+        raise ValueError("%s: not an iNES file" % filename)
+    prg_size = data[4]
+    if (data[7] & 0x0C) == 0x08:
+        prg_size |= (data[9] & 0x0F) << 8
+    prg_size *= 16384
+    start = 16 + (512 if data[6] & 0x04 else 0)
+    prg = memoryview(data)[start:start + prg_size]
+    if len(prg) != prg_size or prg_size % 32768:
+        raise ValueError("%s: PRG ROM is %d bytes, not a multiple of 32768"
+                         % (filename, len(prg)))
+    return prg
+
+def parse_key_block(prg):
+    """Read the key block of an Action 53 collection's PRG ROM.
+
+Return a dict with 'mapper', 'num_banks', 'desc_block_bank', and the
+CPU addresses of directories named in KEY_BLOCK_ADDRS.
+"""
+    final_bank = prg[-0x8000:]
+    kb = bytes(final_bank[:32])
+    if kb[:4] != KEY_BLOCK_ID:
+        raise ValueError("no Action 53 key block at $8000 of last bank")
+    out = {k: kb[offset] | (kb[offset + 1] << 8)
+           for (k, offset) in KEY_BLOCK_ADDRS.items()}
+    out['mapper'] = kb[4]
+    out['num_banks'] = (0x100 - kb[5]) or 0x100
+    out['desc_block_bank'] = kb[20]
+    if out['num_banks'] * 0x8000 != len(prg):
+        raise ValueError("key block says %d banks but PRG ROM has %d"
+                         % (out['num_banks'], len(prg) // 0x8000))
+    return out
+
+def verify_checksums(prg):
+    """Check each 16 KiB of PRG ROM against the checksums directory.
+
+Return a list of (block number, expected, actual) for each
+block that doesn't match.  Block 2 * n is the first half of
+32 KiB bank n.
+"""
+    kb = parse_key_block(prg)
+    num_blocks = len(prg) // CHECKSUM_BLOCK_SIZE
+    offset = len(prg) - 0x8000 + kb['checksums_dir'] - 0x8000
+    expected = prg[offset:offset + 2 * num_blocks]
+    expected = [(expected[i] << 8) | expected[i + 1]
+                for i in range(0, len(expected), 2)]
+    actual = crc16xmodem_blocks(prg, CHECKSUM_BLOCK_SIZE)
+    return [(i, e, a) for (i, (e, a)) in enumerate(zip(expected, actual))
+            if e != a]
+
+def parse_argv(argv):
+    parser = argparse.ArgumentParser(
+        description="Verifies the bank checksums of Action 53 collections."
+    )
+    parser.add_argument("romfile", nargs="+",
+                        help="collection built by a53build (.nes)")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="print only failures")
+    return parser.parse_args(argv[1:])
+
+def main(argv=None):
+    args = parse_argv(argv or sys.argv)
+    failed = False
+    for filename in args.romfile:
+        try:
+            prg = load_nes_prg(filename)
+            bad = verify_checksums(prg)
+        except (OSError, ValueError) as e:
+            print("%s: %s" % (filename, e), file=sys.stderr)
+            failed = True
+            continue
+        for (block, expected, actual) in bad:
+            print("%s: bank %d $%04X-$%04X: checksum $%04X, expected $%04X"
+                  % (filename, block // 2,
+                     0x8000 + (block % 2) * 0x4000,
+                     0xBFFF + (block % 2) * 0x4000,
+                     actual, expected), file=sys.stderr)
+        if bad:
+            failed = True
+        elif not args.quiet:
+            print("%s: %d banks OK" % (filename, len(prg) // 0x8000))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,200 +1,260 @@
 #!/usr/bin/env python3
-import collections
-from binascii import b2a_hex
-
-class A53ROM(collections.Mapping):
-    nplayers_types_list = [
-        '1', '2', '1-2', '1-2 alt', '1-3', '1-4', '2-4 alt', '2-6 alt'
-    ]
-        
-    def __init__(self, prg_rom):
-        """Load an Action 53 compilation's PRG ROM as an 8-bit string."""
-        from bisect import bisect_right
-        self.prg_banks = [prg_rom[i:i + 0x8000]
-                          for i in range(0, len(prg_rom), 0x8000)]
-        last_bank = self.prg_banks[-1]
-        ff00 = [ord(c) for c in last_bank[-256:-240]]
-        self.romdir_addr = (ff00[0] | (ff00[1] << 8)) - 0x8000
-        self.chrdir_addr = (ff00[2] | (ff00[3] << 8)) - 0x8000
-        titledir_addr = (ff00[6] | (ff00[7] << 8)) - 0x8000
-        pagedir_addr = (ff00[8] | (ff00[9] << 8)) - 0x8000
-        name_block_addr = (ff00[10] | (ff00[11] << 8)) - 0x8000
-        desc_block_addr = (ff00[12] | (ff00[13] << 8)) - 0x8000
-        desc_block_bank = ff00[14]
-        
-        num_pages = ord(last_bank[pagedir_addr])
-        self.page_boundaries = [ord(c)
-                                for c in last_bank[pagedir_addr+1:pagedir_addr + num_pages + 1]]
-        num_titles = self.page_boundaries[-1]
-        allpt = last_bank[pagedir_addr + num_pages + 1:]
-        self.page_titles = allpt.split('\0', num_pages)[:num_pages]
-        del allpt
-
-        # Parse all the titles
-        titledir = [last_bank[titledir_addr + i * 16:titledir_addr + i * 16 + 16]
-                    for i in range(num_titles)]
+"""
+Extract ROMs, screenshots, and a config file from an Action 53 collection
+Copyright 2026 Action 53 contributors
+zlib license
+
+A53ROM reads a built collection through a memoryview, normally of a
+memory map of the .nes file, so that opening a large collection
+doesn't copy every bank.  Directories are found through the key
+block at $8000 of the last bank and parsed only when first used.
+
+extract_rom() puts each ROM back together as described in
+a53build.make_rom_directory(): it combines its PRG banks, undoes the
+reset patch where the ROM directory saved the bytes it replaced,
+and decompresses its Donut-compressed CHR ROM.  extraction_notes()
+lists what of a ROM had to be guessed because the ROM directory
+didn't save it.  extract_all() writes every ROM, optionally in
+several processes, each of which maps the collection on its own.
+"""
+import sys
+import os
+import argparse
+from bisect import bisect_right
+from collections.abc import Mapping
+from functools import cached_property
+import donut
+from dte import dte_uncompress
+import a53charset
+from a53checksum import parse_key_block
+
+trace = False
+
+TITLEDIR_ENTRY_SIZE = 32
+SCREENSHOT_HEADER_SIZE = 13
+SCREENSHOT_DONUT_BLOCKS = 28
+DTE_MIN_CODEUNIT = 128  # as in a53build
+
+# Inverse of a53build.players_types
+players_names = {
+    0: '1', 1: '2', 2: '1-2', 3: '1-2 alt', 4: '1-3', 5: '1-4',
+    6: '2-4 alt', 7: '2-6 alt', 8: '2-4', 255: 'none',
+}
+
+_decode_action53 = a53charset.getregentry().decode
+
+def decode_text(data):
+    """Decode a NUL-terminated string in the menu's character set."""
+    data = bytes(data).split(b'\0', 1)[0]
+    return _decode_action53(data, 'replace')[0]
+
+def guess_ines_mapper(mapmode, prg_size, chr_size):
+    """Guess the iNES mapper and mirroring of an extracted ROM.
+
+mapmode -- the title directory's mapper configuration for one of
+    the ROM's titles (see a53build.get_mapmode), or None
+prg_size, chr_size -- sizes in bytes
+
+Return (mapper number, iNES byte 6 mirroring bits).
+"""
+    mirroring = 0x01  # vertical unless the title says otherwise
+    if mapmode is not None:
+        mirroring = {0x02: 0x01, 0x03: 0x00}.get(mapmode & 0x03, 0x00)
+        if (mapmode & 0x0C) == 0x0C and prg_size > 32768:
+            return 2, mirroring  # UNROM
+        if (mapmode & 0x0C) == 0x08 and prg_size > 32768:
+            return 180, mirroring  # UNROM with fixed bottom half
+        if (mapmode & 0x03) < 2:
+            return 7, mirroring  # AOROM: one-screen mirroring
+    if chr_size > 0 and prg_size > 32768:
+        return 66, mirroring  # GNROM: multi PRG ROM, CHR ROM
+    if chr_size > 8192:
+        return 3, mirroring  # CNROM: one PRG ROM, multi CHR ROM
+    if prg_size > 32768:
+        return 34, mirroring  # BNROM: multi PRG ROM, CHR RAM
+    return 0, mirroring  # NROM: one PRG ROM, CHR ROM or RAM
+
+class A53ROM(Mapping):
+    """An Action 53 collection, as a mapping from titles to title info.
+
+prg -- the collection's PRG ROM as a bytes-like object
+filename -- the .nes file it came from, so that worker processes of
+    extract_all() can open it, or None
+
+"""
+
+    def __init__(self, prg, filename=None):
+        self.prg = memoryview(prg)
+        self.filename = filename
+        self.kb = parse_key_block(self.prg)
+        self.last_bank = self.bank(len(self.prg) // 0x8000 - 1)
+
+    @classmethod
+    def from_ines_file(cls, filename):
+        """Map an iNES file into memory and load its PRG ROM."""
+        from ines import load_ines
+        return cls(load_ines(filename, use_mmap=True)['prg'], filename)
+
+    def bank(self, i):
+        """Return a memoryview of 32 KiB PRG bank i."""
+        return self.prg[i * 0x8000:(i + 1) * 0x8000]
+
+    def rom_slice(self, bank, address):
+        """Return a memoryview of a PRG bank from a CPU address to its end."""
+        return self.bank(bank)[address - 0x8000:]
+
+    def last_bank_slice(self, key):
+        """Return a memoryview of the last bank from a key block address."""
+        return self.last_bank[self.kb[key] - 0x8000:]
+
+    # Directories, each parsed when first used
+
+    @cached_property
+    def pages(self):
+        """List of (page name, number of titles before the next page)."""
+        pagedir = self.last_bank_slice('pagedir')
+        num_pages = pagedir[0]
+        ends = list(pagedir[1:num_pages + 1])
+        names = bytes(pagedir[num_pages + 1:]).split(b'\0', num_pages)
+        return [(decode_text(name), end)
+                for (name, end) in zip(names[:num_pages], ends)]
+
+    @cached_property
+    def romdir(self):
+        """Parse the ROM directory.
+
+Return a list of (PRG size in 16384 byte units, PRG bank records,
+CHR directory IDs), where each PRG bank record is a tuple
+(absolute bank number, original reset vector, unpatch data).
+"""
+        romdir = self.last_bank_slice('romdir')
+        pos, roms = 0, []
+        while romdir[pos]:
+            prg_size, chr_size = romdir[pos], romdir[pos + 1]
+            if prg_size > 32:
+                raise ValueError("ROM %d has unexpected PRG size %d"
+                                 % (len(roms), prg_size))
+            pos += 2
+            prgbanks = []
+            for i in range((prg_size + 1) // 2):
+                bank, reset = romdir[pos], romdir[pos + 1] | (romdir[pos + 2] << 8)
+                unpatch_len = romdir[pos + 3]
+                pos += 4
+                if unpatch_len & 0x80:  # a run of one byte value
+                    unpatch_data = bytes(romdir[pos:pos + 1]) * (unpatch_len & 0x7F)
+                    pos += 1
+                else:
+                    unpatch_data = bytes(romdir[pos:pos + unpatch_len])
+                    pos += unpatch_len
+                prgbanks.append((bank, reset, unpatch_data))
+            chrids = list(romdir[pos:pos + chr_size])
+            pos += chr_size
+            if trace:
+                print("ROM %d: PRG size %d, banks %s, CHR %s"
+                      % (len(roms), prg_size,
+                         ", ".join("%d (reset $%04X, unpatch %d bytes)"
+                                   % (b, r, len(u)) for (b, r, u) in prgbanks),
+                         chrids))
+            roms.append((prg_size, prgbanks, chrids))
+        return roms
+
+    @cached_property
+    def dte_replacements(self):
+        """Byte pairs that description code units DTE_MIN_CODEUNIT and up
+stand for."""
+        # The key block points at the table minus 2 bytes per code
+        # unit below DTE_MIN_CODEUNIT that the menu skips
+        table = self.last_bank[self.kb['dte'] - 0x8000
+                               + (DTE_MIN_CODEUNIT - 128) * 2:]
+        return [bytes(table[i:i + 2])
+                for i in range(0, min(len(table), (256 - DTE_MIN_CODEUNIT) * 2), 2)]
+
+    @cached_property
+    def title_list(self):
+        """Parse the title directory into a list of dicts.
+
+See __getitem__() for keys.
+"""
+        kb = self.kb
+        titledir = self.last_bank_slice('titledir')
+        name_block = self.last_bank_slice('name_block')
+        desc_block = self.rom_slice(kb['desc_block_bank'], kb['desc_block'])
+        page_ends = [end for (name, end) in self.pages]
+        num_titles = page_ends[-1] if page_ends else 0
+
         titles = []
-        titleno_by_abs_prg = [set() for row in self.prg_banks]
-        for (titleno, row) in enumerate(titledir):
-            (abs_prg, abs_chr, screenshotid, year,
-             nplayers, u1, u1, u1,
-             title_off, title_offhi, desc_off, desc_offhi, reset, resethi,
-             reg80, u1) = [ord(c) for c in row]
-            title_off += (title_offhi - 0x80) << 8
-            desc_off += (desc_offhi - 0x80) << 8
-            title_author = last_bank[name_block_addr + title_off:]
-            title_author = title_author.split('\0', 1)[0]
-            (title, author) = title_author.split('\n', 1)
-            description = self.prg_banks[desc_block_bank][desc_block_addr + desc_off:]
-            description = description.split('\0', 1)[0]
-            reset += resethi << 8
-            pageno = bisect_right(self.page_boundaries, titleno)
+        for titleno in range(num_titles):
+            entry = titledir[titleno * TITLEDIR_ENTRY_SIZE:
+                             (titleno + 1) * TITLEDIR_ENTRY_SIZE]
+            name_off = entry[8] | (entry[9] << 8)
+            desc_off = entry[10] | (entry[11] << 8)
+            title_author = decode_text(name_block[name_off:])
+            (title, author) = (title_author.split('\n', 1) + [''])[:2]
+            description = bytes(desc_block[desc_off:]).split(b'\0', 1)[0]
+            description = dte_uncompress(description, self.dte_replacements,
+                                         DTE_MIN_CODEUNIT)[0]
             titles.append({
-                'page': self.page_titles[pageno],
+                'page': self.pages[bisect_right(page_ends, titleno)][0],
                 'titleno': titleno,
                 'title': title,
                 'author': author,
-                'screenshotid': screenshotid,
-                'players': self.nplayers_types_list[nplayers],
-                'year': year + 1970,
-                'description': description,
-                'entrypoint': "%04x" % reset,
-                'abs_prg': abs_prg,
-                'abs_chr': abs_chr if abs_chr < 128 else None,
-                'reg80': reg80
+                'screenshotid': entry[2],
+                'players': players_names.get(entry[4], str(entry[4])),
+                'year': entry[3] + 1970,
+                'description': decode_text(description),
+                'entrypoint': "%04x" % (entry[12] | (entry[13] << 8)),
+                'abs_prg': entry[0],
+                'abs_chr': entry[1] if entry[1] < 128 else None,
+                'mapmode': entry[14],
             })
-            titleno_by_abs_prg[abs_prg].add(titleno)
-        del titledir
-
-        # Determine which titles use each CHR bank
-        num_chr = [t['abs_chr'] for t in titles
-                   if t['abs_chr'] is not None]
-        num_chr = max(num_chr) + 1 if num_chr else 0
-        titleno_by_abs_chr = [set() for i in range(num_chr)]
-        for (titleno, title) in enumerate(titles):
-            if title['abs_chr'] is not None:
-                titleno_by_abs_chr[title['abs_chr']].add(titleno)
-
-        self.title_list = titles
-        self.titles_by_name = dict({t['title'], n} for (n, t) in enumerate(titles))
-
-        # Now look up to which ROM each title belongs and which
-        # relative banks within each ROM correspond to each game.
-        self.get_romdir()
-        self.titles_by_romid = []
-        for (romid, (u1, rom_prgbanks, rom_chrids)) in enumerate(self.romdir):
-            titles_in_this_rom = set()
-            for (rel_prg, (abs_prg, u1, u1)) in enumerate(rom_prgbanks):
-                titles_in_this_rom.update(titleno_by_abs_prg[abs_prg])
-                for titleno in titleno_by_abs_prg[abs_prg]:
+
+        # Find which ROM, PRG bank, and CHR bank of it each title uses
+        titleno_by_abs_prg, titleno_by_abs_chr = {}, {}
+        for t in titles:
+            titleno_by_abs_prg.setdefault(t['abs_prg'], []).append(t['titleno'])
+            if t['abs_chr'] is not None:
+                titleno_by_abs_chr.setdefault(t['abs_chr'], []).append(t['titleno'])
+        for (romid, (prg_size, prgbanks, chrids)) in enumerate(self.romdir):
+            for (rel_prg, (abs_prg, reset, unpatch)) in enumerate(prgbanks):
+                for titleno in titleno_by_abs_prg.get(abs_prg, ()):
                     titles[titleno]['romid'] = romid
                     titles[titleno]['prgbank'] = rel_prg
-            self.titles_by_romid.append(titles_in_this_rom)
-            for (rel_chr, abs_chr) in enumerate(rom_chrids):
-                for titleno in titleno_by_abs_chr[abs_chr]:
+            for (rel_chr, abs_chr) in enumerate(chrids):
+                for titleno in titleno_by_abs_chr.get(abs_chr, ()):
                     titles[titleno]['chrbank'] = rel_chr
+        return titles
 
-    @staticmethod
-    def from_ines_file(filename):
-        """Load an iNES ROM, then load its PRG ROM."""
-        from ines import load_ines
-        return A53ROM(load_ines('../a53games.nes')['prg'])
-
-    def get_romdir(self):
-        """Load the ROM directory.
+    @cached_property
+    def titles_by_name(self):
+        return {t['title']: n for (n, t) in enumerate(self.title_list)}
 
-The ROM directory is a list of 3-tuples:
-(PRG size in 16384 byte units, list of PRG bank records,
-list of CHR directory IDs)
-
-Each PRG bank record is also a 3-tuple:
-(absolute bank number, original reset vector, unpatch data)
+    @cached_property
+    def titles_by_romid(self):
+        """List of the title numbers in each ROM."""
+        out = [[] for row in self.romdir]
+        for t in self.title_list:
+            if 'romid' in t:
+                out[t['romid']].append(t['titleno'])
+        return out
 
-"""
-        try:
-            return self.romdir
-        except AttributeError:
-            pass
-
-        last_bank = self.prg_banks[-1]
-        offset = (ord(last_bank[-256]) | (ord(last_bank[-255]) << 8)) - 0x8000
-        print "ROM directory offset: 0x%02x" % offset
-        roms = []
-        it = iter(last_bank[offset:])
-        romdirsz = 0
-        while True:
-            direntsz = 0
-            prgbanks = []
-            prgSize = ord(it.next())
-            if prgSize == 0:
-                break
-            if prgSize > 32:
-                print "romdirsz so far is", romdirsz
-                raise ValueError("ROM %d has unexpected PRG size %d"
-                                 % (len(roms), prgSize))
-            chrSize = ord(it.next())
-            print ("ROM %d has PRG size %d and CHR size %d"
-                   % (len(roms), prgSize, chrSize))
-            direntsz += 2
-            for i in range((prgSize + 1) // 2):
-                bankNum = ord(it.next())
-                resetVector = ord(it.next())
-                resetVector |= ord(it.next()) << 8
-                unpatchLen = ord(it.next())
-                direntsz += 4
-                if unpatchLen > 0x80:
-                    unpatchData = it.next() * (unpatchLen - 0x80)
-                    direntsz += 1
-                else:
-                    unpatchData = ''.join(it.next() for i in range(unpatchLen))
-                    direntsz += unpatchLen
-                prgbanks.append((bankNum, resetVector, unpatchData))
-                print ("> Bank %d, reset %04x, unpatch %d bytes"
-                       % (bankNum, resetVector, len(unpatchData)))
-            chrids = [ord(it.next()) for i in range(chrSize)]
-            print "> CHR banks:", chrids
-            direntsz += chrSize
-            roms.append((prgSize, prgbanks, chrids))
-            print b2a_hex(last_bank[offset + romdirsz:offset + direntsz + romdirsz])
-            romdirsz += direntsz
-        print "ROM directory end: 0x%02x" % (offset + romdirsz)
-        print b2a_hex(last_bank[offset:offset + romdirsz + 1])
-        self.romdir = roms
-        return roms
+    # Mapping methods
 
-    def get_chr_bank(self, chrid):
-        """Extract a CHR bank from the ROM as 8192 bytes of NES tiles."""
-        from pb53 import unpb53
-
-        prg = self.prg_banks
-        chrdir_addr = (ord(prg[-1][-254]) | (ord(prg[-1][-253]) << 8)) - 0x8000
-        chrdir_addr += chrid*5
-        chrdir_entry = [ord(c) for c in prg[-1][chrdir_addr:chrdir_addr + 5]]
-        chrdir_bank = chrdir_entry[0]
-        chrdir_address = (chrdir_entry[1] | (chrdir_entry[2] << 8)) - 0x8000
-        data = unpb53(prg[chrdir_bank][chrdir_address:], 512)
-        return data
-
-    # Sized methods
     def __len__(self):
         """Count the titles in the ROM."""
         return len(self.title_list)
 
-    # Iterable methods
     def __iter__(self):
         """Iterate through the titles of games in the ROM."""
         return (t['title'] for t in self.title_list)
 
-    # Container methods
     def __contains__(self, title):
         """Return True iff title is the title of a game in the ROM."""
         return title in self.titles_by_name
 
-    # Mapping methods
     def __getitem__(self, title):
         """Return information about the game in the ROM with a given title.
 
-These keys correspond to roms.cfg entries:
+These keys correspond to a53.cfg entries:
 page -- the page on which the game appears
 title -- the game's title
 author -- the name of the author
@@ -202,115 +262,183 @@ year -- the year of publication
 players -- a string representing the number of players
 description -- multi-line short instructions
 entrypoint -- the address to start execution
+prgbank, chrbank -- bank of the ROM that the title starts in
 
 These keys don't quite:
 titleno -- the zero-based index of the title in self.title_list
 screenshotid -- the ID of the screenshot for get_screenshot()
-
-These need to be combined with information from get_romdir() to form
-rom, prgbank, and chrbank:
-abs_prg -- absolute PRG bank
-abs_chr -- absolute CHR bank
+romid -- index of the title's ROM in self.romdir
+abs_prg, abs_chr -- absolute PRG bank and CHR directory ID
+mapmode -- the menu's mapper configuration for the title
 
 """
         return self.title_list[self.titles_by_name[title]]
 
-    def iterkeys(self):
-        return iter(self)
-
-    def keys(self):
-        return list(iter(self))
+    # Compressed data
 
-    def itervalues(self):
-        return iter(self.title_list)
-
-    def values(self):
-        return list(self.title_list)
-
-    def iteritems(self):
-        return ((t['title'], t) for t in self.title_list)
-
-    def items(self):
-        return list(self.iteritems())
+    def get_chr_bank(self, chrid):
+        """Decompress a CHR bank to 8192 bytes of NES tiles."""
+        entry = self.last_bank_slice('chrdir')[chrid * 5:chrid * 5 + 5]
+        data = self.rom_slice(entry[0], entry[1] | (entry[2] << 8))
+        return bytes(donut.decompress_blocks(data, 128)[0])
 
     def num_screenshots(self):
-        return max(t['screenshotid'] for t in self.title_list) + 1
+        return max((t['screenshotid'] + 1 for t in self.title_list), default=0)
 
     def get_screenshot_tiles(self, scrid):
-        """Get a screenshot from the ROM in NES tile format.
-
-Return a tuple (tiledata, palette).  tiledata is an 896-byte
-8-bit string, and palette is a list of four NES color numbers.
+        """Decompress a screenshot.
 
+Return a tuple (header, tiledata).  header is the 13-byte palette
+and attribute header of a53screenshot.form_screenshot().  tiledata
+is 28 64-byte blocks: for each 4 tiles, a block of planes 0 and 1
+drawn behind, then a block drawn in front with attribute colors.
 """
-        from pb53 import unpb53
-
-        last_bank = self.prg_banks[-1]
-        ff00 = [ord(c) for c in last_bank[-256:-240]]
-        scrdir_addr = (ff00[4] | (ff00[5] << 8)) - 0x8000 + 6 * scrid
-        scrdata = [ord(c) for c in last_bank[scrdir_addr:scrdir_addr + 6]]
-        (bank, addr, addrhi, c1, c2, c3) = scrdata
-        addr |= addrhi << 8
-        c = unpb53(self.prg_banks[bank][addr - 32768:], 56)
-        return (c, [0x0F, c1, c2, c3])
+        entry = self.last_bank_slice('scrdir')[scrid * 3:scrid * 3 + 3]
+        data = self.rom_slice(entry[0], entry[1] | (entry[2] << 8))
+        tiledata = donut.decompress_blocks(data[SCREENSHOT_HEADER_SIZE:],
+                                           SCREENSHOT_DONUT_BLOCKS)[0]
+        return bytes(data[:SCREENSHOT_HEADER_SIZE]), bytes(tiledata)
 
     def get_screenshot(self, scrid):
-        """Get a screenshot from the ROM as an indexed PIL image."""
-        from ineschr import chrbank_to_pil
-        from nespalette import nespal
-        from itertools import chain
-
-        (tiles, palette) = self.get_screenshot_tiles(scrid)
-        im = chrbank_to_pil(tiles, 8)
-        palette = [nespal[c] for c in palette]
-        p = list(chain(*palette)) + [0] * (768 - 12)
-        im.putpalette(p)
+        """Get a screenshot from the ROM as a 64x56 indexed PIL image."""
+        from PIL import Image
+        from savtool import bisqpal
+
+        header, tiledata = self.get_screenshot_tiles(scrid)
+        palette = [0x0F, 0x00, 0x10, 0x20, 0x0F, *header[0:3],
+                   0x0F, *header[3:6]]
+        pixels = bytearray(64 * 56)
+        for tileno in range(56):
+            group, i = divmod(tileno, 4)
+            bg = tiledata[group * 128 + i * 16:group * 128 + i * 16 + 16]
+            fg = tiledata[group * 128 + 64 + i * 16:group * 128 + 64 + i * 16 + 16]
+            xt, yt = tileno % 8, tileno // 8
+            attr = 8 if header[6 + yt] & (0x80 >> xt) else 4
+            for y in range(8):
+                row = (yt * 8 + y) * 64 + xt * 8
+                for x in range(8):
+                    mask = 0x80 >> x
+                    px = (1 if fg[y] & mask else 0) + (2 if fg[y + 8] & mask else 0)
+                    if px:
+                        px += attr
+                    else:
+                        px = (1 if bg[y] & mask else 0) + (2 if bg[y + 8] & mask else 0)
+                    pixels[row + x] = px
+        im = Image.new('P', (64, 56))
+        im.putdata(pixels)
+        im.putpalette(b''.join(bytes(bisqpal[c]) for c in palette))
         return im
 
-    def extract_rom(self, i):
+    # Extraction
+
+    def extract_rom(self, romid):
         """Extract a ROM in iNES format from the collection.
 
-Return a tuple of three 8-byte strings:
-(16-byte header, PRG ROM, CHR ROM)
-These can be used with ''.join() or writelines().
+Return a tuple of three byte strings: (16-byte header, PRG ROM,
+CHR ROM).  These can be used with b''.join() or writelines().
+The PRG ROM is the original only if extraction_notes() is empty.
 
 """
-        from array import array
-
-        (prgSize, prgbanks, chrbanks) = self.get_romdir()[i]
-        print "rom %d: banks" % i, prgbanks
-        prgbanks = [(array('B', self.prg_banks[b]), reset, array('B', patch))
-                    for (b, reset, patch) in prgbanks]
-        for row in prgbanks:
-            (data, reset, patch) = row
-            patchLoc = (data[-4] | (data[-3] << 8)) - 0x8000
-            data[-4] = reset & 0xFF
-            data[-3] = reset >> 8
-            data[patchLoc:patchLoc + len(patch)] = patch
-        prgbanks = ''.join(data.tostring() for (data, reset, patch) in prgbanks)
-        chrbanks = ''.join(self.get_chr_bank(i) for i in chrbanks)
-        if prgSize == 1:
-            if reset < 0xC000:
-                prgbanks = prgbanks[:0x4000]
+        (prg_size, prgbanks, chrids) = self.romdir[romid]
+        prg = bytearray()
+        for (rel_prg, (bank, reset, unpatch)) in enumerate(prgbanks):
+            data = bytearray(self.bank(bank))
+            # The reset patch starts at the reset vector
+            if unpatch:
+                patch_loc = (data[-4] | (data[-3] << 8)) - 0x8000
+                data[patch_loc:patch_loc + len(unpatch)] = unpatch
+            reset = self.get_original_reset(romid, rel_prg)
+            if reset is not None:
+                data[-4], data[-3] = reset & 0xFF, reset >> 8
+            prg.extend(data)
+
+        # a53build.pad_nrom128() put 16 KiB PRG ROM linked for
+        # $C000-$FFFF in the top half and other 16 KiB in the bottom
+        if prg_size == 1:
+            prg = prg[0x4000:] if prg[-3] >= 0xC0 else prg[:0x4000]
+        chr_data = b''.join(self.get_chr_bank(i) for i in chrids)
+
+        titlenos = self.titles_by_romid[romid]
+        mapmode = self.title_list[titlenos[0]]['mapmode'] if titlenos else None
+        mapper, mirroring = guess_ines_mapper(mapmode, len(prg), len(chr_data))
+        header = bytes([
+            *b'NES\x1a', prg_size, len(chr_data) // 8192,
+            ((mapper & 0x0F) << 4) | mirroring, mapper & 0xF0,
+        ]) + bytes(8)
+        return (header, bytes(prg), chr_data)
+
+    def get_original_reset(self, romid, prgbank):
+        """Find the reset vector of a bank before the exit patch.
+
+The ROM directory saves it, but a53build saves $FFFF (unknown) for
+banks it patches through exitpatch.  For those, assume that the
+entry point of the bank's titles is the reset vector if they all
+agree, or return None to leave the vector as it is.
+"""
+        reset = self.romdir[romid][1][prgbank][1]
+        if reset != 0xFFFF:
+            return reset
+        entrypoints = {self.title_list[titleno]['entrypoint']
+                       for titleno in self.titles_by_romid[romid]
+                       if self.title_list[titleno]['prgbank'] == prgbank}
+        return int(entrypoints.pop(), 16) if len(entrypoints) == 1 else None
+
+    def extraction_notes(self, romid):
+        """List what extract_rom() can't restore exactly for a ROM.
+
+Return a list of strings, one for each PRG bank whose reset vector
+get_original_reset() had to guess and whose exit patch bytes stay
+in place, or an empty list if the ROM directory saved everything
+needed to restore the PRG ROM.  The iNES header is always guessed
+and isn't listed.
+"""
+        (prg_size, prgbanks, chrids) = self.romdir[romid]
+        notes = []
+        for (rel_prg, (bank, reset, unpatch)) in enumerate(prgbanks):
+            if reset != 0xFFFF or unpatch:
+                continue
+            reset = self.get_original_reset(romid, rel_prg)
+            if reset is None:
+                note = ("PRG bank %d: reset vector unknown and left as patched"
+                        % rel_prg)
             else:
-                prgbanks = prgbanks[0x4000:]
-
-        iNESheader = array('B', 'NES\x1A')
-        mapperNumber = 0
-        if len(chrbanks) > 0 and len(prgbanks) > 32768:
-            mapperNumber = 66  # GNROM: multi PRG ROM, CHR ROM
-        elif len(chrbanks) > 8192:
-            mapperNumber = 3  # CNROM: one PRG ROM, multi CHR ROM
-        elif len(prgbanks) > 32768:
-            mapperNumber = 34  # BNROM: multi PRG ROM, CHR RAM
-        else:
-            mapperNumber = 0  # NROM: one PRG ROM, CHR ROM or RAM
-        iNESheader.append(prgSize)
-        iNESheader.append(len(chrbanks) // 8192)
-        iNESheader.append(((mapperNumber & 0x0F) << 4) | 0x01)
-        iNESheader.append(mapperNumber & 0xF0)
-        iNESheader.extend(0 for i in range(8))
-        return (iNESheader.tostring(), prgbanks, chrbanks)
+                note = ("PRG bank %d: reset vector $%04X guessed from the entry point"
+                        % (rel_prg, reset))
+            if prg_size == 1:
+                note += ", which also chose the 16 KiB half"
+            notes.append(note + "; exit patch bytes left in place")
+        return notes
+
+    def write_rom(self, romid, filename):
+        """Extract a ROM and write it to a file.
+
+Return a tuple (filename, extraction_notes(romid)).
+"""
+        with open(filename, 'wb') as outfp:
+            outfp.writelines(self.extract_rom(romid))
+        return (filename, self.extraction_notes(romid))
+
+    def extract_all(self, outdir='.', jobs=1):
+        """Write every ROM to outdir, named by get_rom_filename().
+
+jobs -- number of worker processes; each maps self.filename on its
+    own, so more than 1 needs a collection opened with from_ines_file()
+
+Return a list of (filename, notes) tuples as write_rom() does, where
+ROMs with empty notes were restored exactly and others were partly
+guessed.
+"""
+        filenames = [os.path.join(outdir, self.get_rom_filename(romid))
+                     for romid in range(len(self.romdir))]
+        if jobs > 1 and len(filenames) > 1 and self.filename:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(min(jobs, len(filenames)),
+                                     initializer=_init_worker,
+                                     initargs=(type(self), self.filename)) as executor:
+                return list(executor.map(_write_rom_in_worker,
+                                         range(len(filenames)), filenames))
+        return [self.write_rom(romid, filename)
+                for (romid, filename) in enumerate(filenames)]
 
     def get_rom_filename(self, romid):
         """Come up with a unique filename for the ROM.
@@ -339,19 +467,18 @@ For best results, override this in your subclass.
         return "%s:\n%s\n.\n" % (k, v)
 
     def get_unpatch_range(self, romid, prgbank):
-        (abs_prg, u1, patch) = self.get_romdir()[romid][1][prgbank]
-        data = self.prg_banks[abs_prg]
-        patchLoc = (ord(data[-4]) | (ord(data[-3]) << 8))
-        return (patchLoc, patchLoc + len(patch))
+        (abs_prg, reset, patch) = self.romdir[romid][1][prgbank]
+        data = self.bank(abs_prg)
+        patch_loc = data[-4] | (data[-3] << 8)
+        return (patch_loc, patch_loc + len(patch))
 
     def get_roms_cfg(self):
-        """Make a roms.cfg.
-
-This does NOT attempt to reproduce prgunused or chrunused because of
-a limitation in the pb53 API: it does not report the bytes consumed.
+        """Make the [games] section of an a53.cfg.
 
+The only prgunused entries are those of reset patches that the ROM
+directory saved.
 """
-        out = []
+        out = ["[games]\n\n"]
         last_page = None
         for t in self.title_list:
             pairs = []
@@ -359,14 +486,13 @@ a limitation in the pb53 API: it does not report the bytes consumed.
                 last_page = t['page']
                 pairs.append(('page', last_page))
             romid = t['romid']
-            scrid = t['screenshotid']
             rel_prg = t['prgbank']
             (unused_start, unused_end) = self.get_unpatch_range(romid, rel_prg)
             pairs.extend([('title', t['title']),
                           ('author', t['author']),
                           ('year', t['year']),
                           ('players', t['players']),
-                          ('screenshot', self.get_screenshot_filename(scrid)),
+                          ('screenshot', self.get_screenshot_filename(t['screenshotid'])),
                           ('description', t['description']),
                           ('rom', self.get_rom_filename(romid)),
                           ('prgbank', rel_prg),
@@ -374,21 +500,95 @@ a limitation in the pb53 API: it does not report the bytes consumed.
             if t.get('chrbank') is not None:
                 pairs.append(('chrbank', t['chrbank']))
             if unused_end > unused_start:
-                pairs.append(('prgunused', "%04x-%04x" % (unused_start, unused_end - 1)))
+                pairs.append(('prgunused%d' % rel_prg,
+                              "%04X-%04X" % (unused_start, unused_end - 1)))
             out.extend(self.innieformat(*pair) for pair in pairs)
             out.append("\n")
         return ''.join(out)
 
-rom = A53ROM.from_ines_file('../a53games.nes')
-print ("%d titles in %d ROMs, %d unique screenshots"
-       % (len(rom), len(rom.romdir), rom.num_screenshots()))
-for romid in range(len(rom.romdir)):
-    ines_data = rom.extract_rom(romid)
-    with open(rom.get_rom_filename(romid), "wb") as outfp:
-        outfp.writelines(ines_data)
-del ines_data
-for scrid in range(rom.num_screenshots()):
-    rom.get_screenshot(scrid).save(rom.get_screenshot_filename(scrid))
-cfg_data = rom.get_roms_cfg()
-with open("a53extract_roms.cfg", "wt") as outfp:
-    outfp.write(cfg_data)
+# The collection that each extract_all() worker process maps
+_worker_rom = None
+
+def _init_worker(cls, filename):
+    global _worker_rom
+    _worker_rom = cls.from_ines_file(filename)
+
+def _write_rom_in_worker(romid, filename):
+    return _worker_rom.write_rom(romid, filename)
+
+def parse_argv(argv):
+    parser = argparse.ArgumentParser(
+        description="Extracts ROMs, screenshots, and a config file from Action 53 collections."
+    )
+    parser.add_argument("romfile", nargs="+",
+                        help="collection built by a53build (.nes)")
+    parser.add_argument("-o", "--output-dir", default=".",
+                        help="directory in which to write files; with more"
+                        " than one romfile, each gets a subdirectory"
+                        " named after it (default: current directory)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="write ROMs with up to JOBS processes"
+                        " (default 1; 0 means one per CPU)")
+    parser.add_argument("--no-screenshots", dest="screenshots",
+                        action="store_false",
+                        help="don't write screenshots, which need Pillow")
+    parser.add_argument("-l", "--list", action="store_true",
+                        help="list the titles and ROMs instead of"
+                        " writing anything")
+    args = parser.parse_args(argv[1:])
+    if args.jobs < 1:
+        args.jobs = os.cpu_count() or 1
+    return args
+
+def extract_collection(filename, outdir, jobs=1, screenshots=True):
+    """Write a collection's ROMs, screenshots, and a53extract_roms.cfg."""
+    rom = A53ROM.from_ines_file(filename)
+    os.makedirs(outdir, exist_ok=True)
+    written = rom.extract_all(outdir, jobs)
+    for (romfilename, notes) in written:
+        for note in notes:
+            print("%s: approximate: %s" % (romfilename, note), file=sys.stderr)
+    if screenshots:
+        for scrid in range(rom.num_screenshots()):
+            rom.get_screenshot(scrid).save(
+                os.path.join(outdir, rom.get_screenshot_filename(scrid))
+            )
+    with open(os.path.join(outdir, "a53extract_roms.cfg"), "w",
+              encoding="utf-8") as outfp:
+        outfp.write(rom.get_roms_cfg())
+    num_approximate = sum(1 for (romfilename, notes) in written if notes)
+    print("%s: %d titles in %d ROMs (%d exact, %d approximate), %d unique screenshots"
+          % (filename, len(rom), len(rom.romdir),
+             len(written) - num_approximate, num_approximate,
+             rom.num_screenshots()))
+
+def list_collection(filename):
+    rom = A53ROM.from_ines_file(filename)
+    for (romid, (prg_size, prgbanks, chrids)) in enumerate(rom.romdir):
+        print("%s ROM %d: %d KiB PRG in banks %s, %d CHR banks%s"
+              % (filename, romid, prg_size * 16,
+                 ", ".join(str(b[0]) for b in prgbanks), len(chrids),
+                 " (approximate)" if rom.extraction_notes(romid) else ""))
+        for titleno in rom.titles_by_romid[romid]:
+            t = rom.title_list[titleno]
+            print("  %s (%s, %d)" % (t['title'], t['author'], t['year']))
+
+def main(argv=None):
+    args = parse_argv(argv or sys.argv)
+    failed = False
+    for filename in args.romfile:
+        outdir = args.output_dir
+        if len(args.romfile) > 1:
+            outdir = os.path.join(outdir, os.path.splitext(os.path.basename(filename))[0])
+        try:
+            if args.list:
+                list_collection(filename)
+            else:
+                extract_collection(filename, outdir, args.jobs, args.screenshots)
+        except (OSError, ValueError) as e:
+            print("%s: %s" % (filename, e), file=sys.stderr)
+            failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
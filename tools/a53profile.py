@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Estimate how long the menu takes to decode a built Action 53 collection
+Copyright 2026 Action 53 contributors
+zlib license
+
+The menu decompresses the title screen at power on, a screenshot
+each time the cursor moves to another title, and a title's CHR ROM
+when it starts the title.  donut.cblock_cycles() estimates the CPU
+time to decode each Donut block.  Loading CHR ROM also takes the
+menu's time to fetch each block from another bank and upload it,
+which donut.chr_block_cycles() adds.  This tool finds the title
+screen, CHR directory, and screenshot directory through the key
+block, adds up the estimates for each block, and reports them per
+CHR bank, per screenshot, and per title, along with the slowest
+blocks, so that a collection whose menu would stall can be caught
+before it is flashed.
+"""
+import sys
+import argparse
+import heapq
+import donut
+import a53charset
+from a53checksum import load_nes_prg, parse_key_block
+
+# CPU cycles per frame: 341 dots per line, 3 (NTSC) or 3.2 (PAL)
+# dots per CPU cycle
+NTSC_FRAME_CYCLES = 341 * 262 / 3
+PAL_FRAME_CYCLES = 341 * 312 / 3.2
+
+TITLEDIR_ENTRY_SIZE = 32
+SCREENSHOT_HEADER_SIZE = 13
+SCREENSHOT_DONUT_BLOCKS = 28
+TITLE_SCREEN_NAM_BLOCKS = 16
+
+def block_cycles(data, num_blocks):
+    """Estimate the decode time of each of a run of Donut blocks.
+
+data -- a bytes-like object starting with the blocks
+num_blocks -- number of blocks to read
+
+Return a list of (cycles, block header) for each block.
+"""
+    mv = memoryview(data)
+    pos, out = 0, []
+    for i in range(num_blocks):
+        used = donut.decompress_blocks(mv[pos:], 1)[1]
+        if not used:
+            raise ValueError("block %d of %d is past the end of the bank"
+                             % (i, num_blocks))
+        cblock = mv[pos:pos + used]
+        out.append((donut.cblock_cycles(cblock), cblock[0]))
+        pos += used
+    return out
+
+class DecodeProfile(object):
+    """Decode time estimates for a built collection.
+
+prg -- the collection's PRG ROM, as from a53checksum.load_nes_prg()
+
+.title_screen is a list of (cycles, header) for each block of the
+title screen's tiles and then its nametable.
+.chr_banks and .screenshots are lists of (bank, address, blocks)
+tuples in directory order, where blocks is as in .title_screen.
+CHR blocks include the loader's time, as in donut.chr_block_cycles().
+.titles is a list of dicts with keys 'name', 'chr_ids', and
+'screenshot_id', one for each title in the title directory.
+"""
+
+    def __init__(self, prg):
+        self.prg = prg
+        self.kb = kb = parse_key_block(prg)
+        final_bank = prg[-0x8000:]
+
+        pagedir = final_bank[kb['pagedir'] - 0x8000:]
+        num_titles = pagedir[pagedir[0]] if pagedir[0] else 0
+        titledir = final_bank[kb['titledir'] - 0x8000:]
+        name_block = final_bank[kb['name_block'] - 0x8000:]
+        self.titles = []
+        for i in range(num_titles):
+            entry = titledir[i * TITLEDIR_ENTRY_SIZE:(i + 1) * TITLEDIR_ENTRY_SIZE]
+            name_offset = entry[8] | (entry[9] << 8)
+            name = bytes(name_block[name_offset:name_offset + 128])
+            name = name.split(b'\n', 1)[0].split(b'\0', 1)[0]
+            chr_ids = (list(range(entry[1], entry[1] + entry[5]))
+                       if entry[1] < 128 else [])
+            self.titles.append({
+                'name': name.decode('action53', errors='replace'),
+                'chr_ids': chr_ids, 'screenshot_id': entry[2],
+            })
+        num_chr = max((max(t['chr_ids']) + 1 for t in self.titles
+                       if t['chr_ids']), default=0)
+        num_screenshots = max((t['screenshot_id'] + 1 for t in self.titles),
+                              default=0)
+
+        chrdir = final_bank[kb['chrdir'] - 0x8000:]
+        self.chr_banks = []
+        for i in range(num_chr):
+            bank, address = chrdir[i * 5], chrdir[i * 5 + 1] | (chrdir[i * 5 + 2] << 8)
+            self.chr_banks.append((bank, address, donut.chr_block_cycles(
+                self.rom_slice(bank, address)
+            )))
+
+        scrdir = final_bank[kb['scrdir'] - 0x8000:]
+        self.screenshots = []
+        for i in range(num_screenshots):
+            bank, address = scrdir[i * 3], scrdir[i * 3 + 1] | (scrdir[i * 3 + 2] << 8)
+            data = self.rom_slice(bank, address)[SCREENSHOT_HEADER_SIZE:]
+            self.screenshots.append((bank, address, block_cycles(
+                data, SCREENSHOT_DONUT_BLOCKS
+            )))
+
+        # The title screen is the number of 4-tile blocks, tiles,
+        # nametable and attributes, and palette
+        data = final_bank[kb['title_screen'] - 0x8000:]
+        self.title_screen = block_cycles(data[1:],
+                                         data[0] + TITLE_SCREEN_NAM_BLOCKS)
+
+    def rom_slice(self, bank, address):
+        return self.prg[bank * 0x8000 + address - 0x8000:(bank + 1) * 0x8000]
+
+    def title_cycles(self, title):
+        """Return (CHR cycles, screenshot cycles) of a title."""
+        chr_cycles = sum(sum(c for c, h in self.chr_banks[i][2])
+                         for i in title['chr_ids'])
+        scr_cycles = sum(c for c, h in self.screenshots[title['screenshot_id']][2])
+        return chr_cycles, scr_cycles
+
+    def worst_blocks(self, count):
+        """Find the slowest blocks.
+
+Return a list of (cycles, header, object name, block number), slowest
+first.
+"""
+        def all_blocks():
+            for (i, c) in enumerate(self.title_screen):
+                yield c + ("title screen", i)
+            for (name, objs) in (("CHR bank", self.chr_banks),
+                                 ("screenshot", self.screenshots)):
+                for (j, (bank, address, blocks)) in enumerate(objs):
+                    objname = "%s %d at %d:%04X" % (name, j, bank, address)
+                    for (i, c) in enumerate(blocks):
+                        yield c + (objname, i)
+        return heapq.nlargest(count, all_blocks(), key=lambda x: x[0])
+
+def parse_argv(argv):
+    parser = argparse.ArgumentParser(
+        description="Estimates the time to decode CHR ROM and screenshots of Action 53 collections."
+    )
+    parser.add_argument("romfile", help="collection built by a53build (.nes)")
+    parser.add_argument("--pal", action="store_true",
+                        help="count frames of a PAL NES instead of NTSC")
+    parser.add_argument("--worst", type=int, default=10, metavar="N",
+                        help="list the N slowest blocks (default: %(default)s)")
+    parser.add_argument("--max-frames", type=float, metavar="FRAMES",
+                        help="exit with status 1 if any screenshot or"
+                        " title's CHR ROM takes longer than FRAMES")
+    return parser.parse_args(argv[1:])
+
+def main(argv=None):
+    args = parse_argv(argv or sys.argv)
+    a53charset.register()
+    frame_cycles = PAL_FRAME_CYCLES if args.pal else NTSC_FRAME_CYCLES
+    try:
+        profile = DecodeProfile(load_nes_prg(args.romfile))
+    except (OSError, ValueError) as e:
+        print("%s: %s" % (args.romfile, e), file=sys.stderr)
+        sys.exit(1)
+
+    def fmt(cycles):
+        return "%8d cycles %6.1f frames" % (cycles, cycles / frame_cycles)
+
+    def table_row(widths, cells):
+        """Left-align the first cell and right-align the rest in widths."""
+        return " ".join(["%-*s" % (widths[0], cells[0])]
+                        + ["%*s" % wc for wc in zip(widths[1:], cells[1:])])
+
+    # Column widths of each table, shared by its header and rows
+    obj_widths = (14, 8, 6, len(fmt(0)), 6)
+    title_widths = (32, len(fmt(0)), len(fmt(0)))
+
+    print("title screen:  %3d blocks %s"
+          % (len(profile.title_screen),
+             fmt(sum(c for c, h in profile.title_screen))))
+    for (name, objs) in (("CHR bank", profile.chr_banks),
+                         ("screenshot", profile.screenshots)):
+        print("\n" + table_row(obj_widths, (name + "s", "at", "blocks",
+                                            "total", "worst")))
+        for (i, (bank, address, blocks)) in enumerate(objs):
+            print(table_row(obj_widths, (
+                "%-10s %3d" % (name, i), "%d:%04X" % (bank, address),
+                len(blocks), fmt(sum(c for c, h in blocks)),
+                max(c for c, h in blocks)
+            )))
+
+    print("\n" + table_row(title_widths, ("title", "CHR ROM", "screenshot")))
+    too_slow = []
+    for title in profile.titles:
+        chr_cycles, scr_cycles = profile.title_cycles(title)
+        print(table_row(title_widths, (title['name'][:32], fmt(chr_cycles),
+                                       fmt(scr_cycles))))
+        if (args.max_frames is not None
+            and max(chr_cycles, scr_cycles) > args.max_frames * frame_cycles):
+            too_slow.append(title['name'])
+
+    if args.worst > 0:
+        print("\nslowest blocks:")
+        for (cycles, header, objname, i) in profile.worst_blocks(args.worst):
+            print("%6d cycles, header $%02X: %s block %d"
+                  % (cycles, header, objname, i))
+
+    all_chr = sum(c for b in profile.chr_banks for c, h in b[2])
+    all_scr = sum(c for b in profile.screenshots for c, h in b[2])
+    print("\ntotal: %d CHR banks %s; %d screenshots %s"
+          % (len(profile.chr_banks), fmt(all_chr).strip(),
+             len(profile.screenshots), fmt(all_scr).strip()))
+    if too_slow:
+        print("%s: %d titles take longer than %g frames to load: %s"
+              % (args.romfile, len(too_slow), args.max_frames,
+                 ", ".join(too_slow)), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Bin packing strategies for data inserted into unused PRG ROM
+Copyright 2026 Action 53 contributors
+zlib license
+
+a53build inserts compressed CHR ROM, screenshots, and descriptions
+into ranges of PRG ROM that the activities don't use.  Each strategy
+here plans where every object goes, then pack() writes them.
+
+ffd -- First Fit Decreasing, as ffd_add() has always done
+bfd -- Best Fit Decreasing: each object goes into the smallest range
+    that holds it, which leaves large ranges for large objects
+exhaustive -- try ffd and bfd, and if neither fits, search all
+    placements (branch and bound) until a time budget runs out
+
+Objects are passed as a list of groups, each a list of byte strings.
+ffd and bfd place each group in turn, largest object first, so that
+CHR data doesn't end up scattered among screenshots.  exhaustive
+considers all objects together.
+"""
+from firstfit import FreeSpaceIndex, slices_remove
+
+def copy_ranges(prgbanks):
+    """Copy the slice lists of PRG banks for planning."""
+    return [(None, list(unused_ranges)) for (romdata, unused_ranges) in prgbanks]
+
+def decreasing_order(lens):
+    """Return indices into lens, longest first, ties in original order."""
+    return sorted(range(len(lens)), key=lambda i: -lens[i])
+
+def ffd_plan(prgbanks, groups_lens, time_budget=None):
+    """Plan First Fit Decreasing placement.
+
+prgbanks -- a list of (bytearray, slice list) tuples, not modified
+groups_lens -- a list of lists of object lengths
+
+Return a list of lists of (bank, address) tuples parallel to
+groups_lens, or raise ValueError if something doesn't fit.
+"""
+    space = FreeSpaceIndex(copy_ranges(prgbanks))
+    plan = []
+    for lens in groups_lens:
+        placements = [None] * len(lens)
+        for i in decreasing_order(lens):
+            placements[i] = space.allocate(lens[i])
+        plan.append(placements)
+    return plan
+
+def bfd_plan(prgbanks, groups_lens, time_budget=None):
+    """Plan Best Fit Decreasing placement.
+
+Of all unused ranges large enough, each object goes into the
+smallest, breaking ties by lowest bank and then lowest address.
+Arguments and return same as those for ffd_plan.
+"""
+    from bisect import bisect_left, insort
+
+    # Sorted list of (size, bank, start, end) for each unused range
+    free = sorted((end - start, bank, start, end)
+                  for (bank, (romdata, unused_ranges)) in enumerate(prgbanks)
+                  for (start, end) in unused_ranges)
+    plan = []
+    for lens in groups_lens:
+        placements = [None] * len(lens)
+        for i in decreasing_order(lens):
+            datalen = lens[i]
+            idx = bisect_left(free, (datalen,))
+            if idx >= len(free):
+                raise ValueError("could not add bank")
+            size, bank, start, end = free.pop(idx)
+            placements[i] = (bank, start)
+            if start + datalen < end:
+                insort(free, (size - datalen, bank, start + datalen, end))
+        plan.append(placements)
+    return plan
+
+class PackingTimeout(Exception):
+    pass
+
+def exhaustive_plan(prgbanks, groups_lens, time_budget=10.0):
+    """Plan placement by trying heuristics, then searching.
+
+If neither ffd_plan nor bfd_plan fits everything, search depth first
+for any placement that fits, largest objects first, trying smaller
+ranges first and skipping ranges the same size as one already tried.
+Give up with ValueError after time_budget seconds.
+
+Arguments and return same as those for ffd_plan.
+"""
+    from time import perf_counter
+
+    for plan_fn in (ffd_plan, bfd_plan):
+        try:
+            return plan_fn(prgbanks, groups_lens)
+        except ValueError:
+            pass
+
+    items = [(datalen, g, i)
+             for (g, lens) in enumerate(groups_lens)
+             for (i, datalen) in enumerate(lens)]
+    items.sort(key=lambda x: -x[0])
+    lens = [x[0] for x in items]
+    remaining = [0] * (len(lens) + 1)
+    for n in range(len(lens) - 1, -1, -1):
+        remaining[n] = remaining[n + 1] + lens[n]
+
+    extents = [[start, end]
+               for (romdata, unused_ranges) in prgbanks
+               for (start, end) in unused_ranges]
+    banks = [bank
+             for (bank, (romdata, unused_ranges)) in enumerate(prgbanks)
+             for r in unused_ranges]
+    choice = [None] * len(lens)
+    deadline = perf_counter() + time_budget
+    nodes = [0]
+
+    def search(n):
+        if n >= len(lens):
+            return True
+        nodes[0] += 1
+        if nodes[0] % 1024 == 0 and perf_counter() > deadline:
+            raise PackingTimeout()
+
+        # Bound: the rest must fit in ranges at least as large as the
+        # smallest remaining object
+        smallest = lens[-1]
+        usable = sum(e[1] - e[0] for e in extents
+                     if e[1] - e[0] >= smallest)
+        if usable < remaining[n]:
+            return False
+
+        datalen = lens[n]
+        candidates = sorted((e[1] - e[0], x)
+                            for (x, e) in enumerate(extents)
+                            if e[1] - e[0] >= datalen)
+        tried_sizes = set()
+        for size, x in candidates:
+            if size in tried_sizes:
+                continue
+            tried_sizes.add(size)
+            choice[n] = (x, extents[x][0])
+            extents[x][0] += datalen
+            if search(n + 1):
+                return True
+            extents[x][0] -= datalen
+        return False
+
+    try:
+        found = search(0)
+    except PackingTimeout:
+        raise ValueError("could not add bank: no placement found in %.1f s"
+                         % time_budget)
+    if not found:
+        raise ValueError("could not add bank: no placement exists")
+
+    plan = [[None] * len(lens) for lens in groups_lens]
+    for (datalen, g, i), (x, address) in zip(items, choice):
+        plan[g][i] = (banks[x], address)
+    return plan
+
+packers = {
+    'ffd': ffd_plan,
+    'bfd': bfd_plan,
+    'exhaustive': exhaustive_plan,
+}
+
+def pack(prgbanks, groups, packer='ffd', time_budget=10.0):
+    """Insert groups of byte strings into unused ranges of PRG banks.
+
+prgbanks -- a list of (bytearray, slice list) tuples
+groups -- a list of lists of byte strings
+packer -- a key of packers
+time_budget -- seconds that the exhaustive packer may search
+
+Return a list of lists of (bank, address) tuples parallel to groups,
+or raise ValueError if they don't fit, leaving prgbanks unchanged.
+"""
+    from array import array
+
+    groups_lens = [[len(data) for data in group] for group in groups]
+    plan = packers[packer](prgbanks, groups_lens, time_budget)
+    write_plan(prgbanks, groups, plan)
+    return plan
+
+def write_plan(prgbanks, groups, plan):
+    """Insert groups of byte strings where a plan says.
+
+prgbanks -- a list of (writable buffer, slice list) tuples
+groups -- a list of lists of byte strings
+plan -- a list of lists of (bank, address) tuples parallel to groups
+
+"""
+    from array import array
+
+    # Write in address order so that each slices_remove() cuts the
+    # start of an unused range
+    writes = sorted((bank, address, g, i)
+                    for (g, placements) in enumerate(plan)
+                    for (i, (bank, address)) in enumerate(placements))
+    for (bank, address, g, i) in writes:
+        data = groups[g][i]
+        offset = address - 0x8000
+        (romdata, unused_ranges) = prgbanks[bank]
+        romdata[offset:offset + len(data)] = array('B', data)
+        slices_remove(unused_ranges, (address, address + len(data)))
+
+def reserve(unused_ranges, address, datalen):
+    """Remove a range from a slice list if it is entirely unused.
+
+Return True if it was removed or False if any of it was in use.
+"""
+    end = address + datalen
+    if not any(start <= address and end <= range_end
+               for (start, range_end) in unused_ranges):
+        return False
+    slices_remove(unused_ranges, (address, end))
+    return True
+
+def bank_free_bytes(prgbanks):
+    """Count the unused bytes left in each PRG bank."""
+    return [sum(end - start for (start, end) in unused_ranges)
+            for (romdata, unused_ranges) in prgbanks]
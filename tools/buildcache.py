@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Persistent content-addressed cache for Action 53 build products
+Copyright 2026 Action 53 contributors
+zlib license
+
+Compressing CHR ROM banks and screenshots is the slowest part of
+building a collection, yet most of the data going into the compressor
+is the same from one build to the next.  So a53build looks up each
+result by a hash of everything that determines it (the raw data, the
+codec and its version, and codec options) before compressing.
+
+Each entry is one file named after its key.  Looking up an entry
+updates its modification time, and trim() deletes the least recently
+used entries until the whole cache fits in max_size bytes.
+"""
+import os
+import sys
+import hashlib
+
+# Default size bound for the cache directory
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+def default_cache_dir():
+    """Return the per-user cache directory for a53build."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'a53build')
+
+class BuildCache(object):
+    """Cache byte strings on disk keyed by a hash of their inputs.
+
+cache_dir -- directory to store entries in, or None to disable the
+    cache (get() always misses and put() does nothing)
+max_size -- trim() evicts entries until the cache totals this many
+    bytes or fewer
+
+"""
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def make_key(*parts):
+        """Hash a sequence of byte strings and text strings into a key.
+
+Each part is length-prefixed so that ('ab', 'c') and ('a', 'bc')
+produce different keys.
+"""
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            h.update(b'%d:' % len(part))
+            h.update(part)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """Return the byte string stored under key, or None."""
+        if self.cache_dir is None:
+            return None
+        filename = self._path(key)
+        try:
+            with open(filename, 'rb') as infp:
+                data = infp.read()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Store a byte string under key."""
+        if self.cache_dir is None:
+            return
+        filename = self._path(key)
+        tmpname = '%s.%d.tmp' % (filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(tmpname, 'wb') as outfp:
+                outfp.write(data)
+            os.replace(tmpname, filename)
+        except OSError as e:
+            print("%s: could not cache: %s" % (filename, e), file=sys.stderr)
+
+    def get_or_compute(self, key, fn, *args):
+        """Return the data stored under key, or fn(*args) after storing it."""
+        data = self.get(key)
+        if data is None:
+            data = fn(*args)
+            self.put(key, data)
+        return data
+
+    def trim(self):
+        """Delete least recently used entries until under max_size."""
+        if self.cache_dir is None:
+            return
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                filename = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, filename))
+        total = sum(row[1] for row in entries)
+        entries.sort()
+        for mtime, size, filename in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            total -= size
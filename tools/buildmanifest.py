@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Build manifest for incremental Action 53 builds
+Copyright 2026 Action 53 contributors
+zlib license
+
+After writing a ROM, a53build writes a manifest next to it
+(a53games.nes.manifest) in JSON recording:
+
+- a hash of each input file (config, ROMs, images, menu)
+- build options that affect the output
+- for each compressed object (CHR bank, screenshot, descriptions),
+  the build cache key of its inputs, the hash of its compressed
+  data, and where in the ROM it was put
+- a hash of the ROM itself
+- the ROM's size and unused space, which --stats repeats for a
+  build that found nothing changed
+
+With --incremental, a53build reads the previous manifest.  If no
+input or option changed, it leaves the ROM alone.  Otherwise, it
+reads any compressed object whose key is unchanged back out of the
+previous ROM instead of compressing it again, and puts objects
+whose data is unchanged back where they were if that space is
+still free.
+"""
+import os
+import sys
+import json
+import hashlib
+from buildcache import BuildCache, DEFAULT_MAX_SIZE
+
+# Bump when the manifest format changes
+MANIFEST_VERSION = 1
+
+INES_HEADER_SIZE = 16
+
+def file_sha256(filename):
+    """Return the SHA-256 of a file's contents, or None if unreadable."""
+    h = hashlib.sha256()
+    try:
+        with open(filename, 'rb') as infp:
+            for block in iter(lambda: infp.read(65536), b''):
+                h.update(block)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+def data_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def rom_offset(bank, address):
+    """Find the file offset of a CPU address in a 32 KiB PRG bank."""
+    return INES_HEADER_SIZE + bank * 0x8000 + (address - 0x8000)
+
+class BuildManifest(object):
+    """Inputs, options, and object placements of one build.
+
+options -- a dict of JSON-serializable build options
+
+"""
+
+    def __init__(self, options=None):
+        self.options = dict(options or {})
+        self.inputs = {}
+        self.objects = []
+        self.output_sha256 = None
+        self.sizes = {}
+        self.rom = None
+        self._by_key = self._by_digest = None
+
+    def add_input(self, filename):
+        """Record the hash of an input file."""
+        if filename not in self.inputs:
+            self.inputs[filename] = file_sha256(filename)
+
+    def add_object(self, kind, key, data, parts, raw_length=None):
+        """Record where a compressed object went.
+
+kind -- 'chr', 'screenshot', or 'descriptions'
+key -- the build cache key of the object's inputs
+data -- the compressed object
+parts -- a list of (bank, address, length) tuples whose ROM bytes,
+    concatenated, equal data
+raw_length -- the object's size before compression
+
+"""
+        self.objects.append({
+            'kind': kind, 'key': key, 'sha256': data_sha256(data),
+            'length': len(data), 'raw_length': raw_length,
+            'parts': [list(part) for part in parts],
+        })
+
+    def save(self, filename, romdata):
+        """Write the manifest for a ROM whose contents are romdata."""
+        self.output_sha256 = data_sha256(romdata)
+        doc = {
+            'version': MANIFEST_VERSION,
+            'options': self.options,
+            'inputs': self.inputs,
+            'output_sha256': self.output_sha256,
+            'objects': self.objects,
+            'sizes': self.sizes,
+        }
+        tmpname = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmpname, 'w', encoding='utf-8') as outfp:
+            json.dump(doc, outfp, indent=1, sort_keys=True)
+        os.replace(tmpname, filename)
+
+    @classmethod
+    def load(cls, filename, romfilename):
+        """Load a manifest along with the ROM it describes.
+
+Return a BuildManifest, or None if either file is missing or the
+ROM was changed since the manifest was written.
+"""
+        try:
+            with open(filename, 'r', encoding='utf-8') as infp:
+                doc = json.load(infp)
+            with open(romfilename, 'rb') as infp:
+                romdata = infp.read()
+        except (OSError, ValueError) as e:
+            print("%s: not using previous build: %s" % (filename, e),
+                  file=sys.stderr)
+            return None
+        if doc.get('version') != MANIFEST_VERSION:
+            print("%s: not using previous build: manifest version %s"
+                  % (filename, doc.get('version')), file=sys.stderr)
+            return None
+        if doc.get('output_sha256') != data_sha256(romdata):
+            print("%s: not using previous build: %s changed since"
+                  % (filename, romfilename), file=sys.stderr)
+            return None
+        self = cls(doc['options'])
+        self.inputs = doc['inputs']
+        self.objects = doc['objects']
+        self.output_sha256 = doc['output_sha256']
+        self.sizes = doc.get('sizes', {})
+        self.rom = romdata
+        return self
+
+    def changed_inputs(self):
+        """List recorded input files whose contents changed."""
+        return sorted(filename for (filename, digest) in self.inputs.items()
+                      if file_sha256(filename) != digest)
+
+    def _index(self):
+        if self._by_key is None:
+            self._by_key, self._by_digest = {}, {}
+            for obj in self.objects:
+                self._by_key.setdefault(obj['key'], obj)
+                self._by_digest.setdefault((obj['kind'], obj['sha256']),
+                                           []).append(obj)
+
+    def get(self, key):
+        """Read the object stored under key back out of the ROM.
+
+Return its compressed data, or None if there is no such object.
+"""
+        if self.rom is None:
+            return None
+        self._index()
+        obj = self._by_key.get(key)
+        if obj is None:
+            return None
+        data = b''.join(
+            self.rom[rom_offset(bank, address):rom_offset(bank, address) + length]
+            for (bank, address, length) in obj['parts']
+        )
+        if data_sha256(data) != obj['sha256']:
+            return None
+        return data
+
+    def placements(self, kind, data):
+        """List (bank, address) tuples where data of this kind went."""
+        self._index()
+        found = self._by_digest.get((kind, data_sha256(data)), [])
+        return [tuple(obj['parts'][0][:2]) for obj in found
+                if len(obj['parts']) == 1]
+
+class ManifestCache(BuildCache):
+    """A BuildCache that falls back to objects in a previous build.
+
+previous -- a BuildManifest loaded with its ROM, or None
+
+Objects read from the previous build are counted in reused,
+not in hits or misses.
+"""
+
+    def __init__(self, cache_dir=None, previous=None,
+                 max_size=DEFAULT_MAX_SIZE):
+        BuildCache.__init__(self, cache_dir, max_size)
+        self.previous = previous
+        self.reused = 0
+
+    def get(self, key):
+        data = self.previous.get(key) if self.previous else None
+        if data is not None:
+            self.reused += 1
+            return data
+        return BuildCache.get(self, key)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Timing and size statistics for Action 53 builds
+Copyright 2026 Action 53 contributors
+zlib license
+
+a53build --stats FILE writes a JSON report with the wall time and
+peak memory of each phase of the build and the size of each class
+of object before and after compression, so that CI can track build
+time regressions and see which collections are nearly full.
+
+Peak memory is the operating system's high-water mark of resident
+set size at the end of each phase, in KiB, for this process and
+for the largest child process (compression workers or DTE).  It
+is None where the resource module isn't available (Windows).
+"""
+import sys
+import json
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_kib():
+    """Return (self, largest child) peak resident set size in KiB."""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    scale = 1024 if sys.platform == 'darwin' else 1
+    return tuple(resource.getrusage(who).ru_maxrss // scale
+                 for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+class BuildStats(object):
+    """Collect per-phase times and per-class sizes of a build.
+
+Call begin(name) at the start of each phase.  It ends the phase
+before it, so phases run back to back until end().  A phase begun
+more than once accumulates its time.
+"""
+
+    def __init__(self):
+        self.phases = {}
+        self.objects = {}
+        self.values = {}
+        self.cur_phase = self.cur_start = None
+        self.start = perf_counter()
+
+    def begin(self, name):
+        """End the current phase, if any, and start another."""
+        self.end()
+        self.cur_phase, self.cur_start = name, perf_counter()
+
+    def end(self):
+        """End the current phase."""
+        if self.cur_phase is None:
+            return
+        seconds = perf_counter() - self.cur_start
+        rss, children_rss = peak_rss_kib()
+        phase = self.phases.setdefault(self.cur_phase, {'seconds': 0.0})
+        phase['seconds'] += seconds
+        phase['peak_rss_kib'] = rss
+        phase['children_peak_rss_kib'] = children_rss
+        self.cur_phase = None
+
+    def add_objects(self, kind, raw_bytes, compressed_bytes, count=1):
+        """Count objects of a class and their sizes."""
+        row = self.objects.setdefault(kind, {
+            'count': 0, 'raw_bytes': 0, 'compressed_bytes': 0,
+        })
+        row['count'] += count
+        row['raw_bytes'] += raw_bytes
+        row['compressed_bytes'] += compressed_bytes
+
+    def set(self, name, value):
+        """Record another JSON-serializable value."""
+        self.values[name] = value
+
+    def as_dict(self):
+        self.end()
+        rss, children_rss = peak_rss_kib()
+        return {
+            'total_seconds': perf_counter() - self.start,
+            'peak_rss_kib': rss,
+            'children_peak_rss_kib': children_rss,
+            'phases': [dict(row, name=name)
+                       for (name, row) in self.phases.items()],
+            'objects': self.objects,
+            **self.values
+        }
+
+    def save(self, filename):
+        """Write statistics as JSON to a file, or '-' for stdout."""
+        doc = json.dumps(self.as_dict(), indent=1, sort_keys=True)
+        if filename == '-':
+            print(doc)
+            return
+        with open(filename, 'w', encoding='utf-8') as outfp:
+            outfp.write(doc)
+            outfp.write('\n')
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-"""Pure python library for calculating CRC16"""
+"""Library for calculating CRC16 (XModem)"""
 
 ##############################################################################
 #
@@ -20,6 +20,7 @@
 #
 ##############################################################################
 
+from binascii import crc_hqx
 
 # table for calculating CRC
 # this particular table was generated using pycrc v0.7.6, http://www.tty1.net/pycrc/
@@ -81,10 +82,33 @@ def _crc16(data, crc, table):
     return crc & 0xffff
 
 
-def crc16xmodem(data, crc=0):
-    """Calculate CRC-CCITT (XModem) variant of CRC16.
+def crc16xmodem_pure(data, crc=0):
+    """Calculate CRC-CCITT (XModem) variant of CRC16 in Python.
     `data`      - data for calculating CRC, must be bytes
     `crc`       - initial value
     Return calculated value of CRC
     """
     return _crc16(data, crc, CRC16_XMODEM_TABLE)
+
+
+def crc16xmodem(data, crc=0):
+    """Calculate CRC-CCITT (XModem) variant of CRC16.
+    `data`      - data for calculating CRC, any bytes-like object
+    `crc`       - initial value
+    Return calculated value of CRC
+
+    binascii.crc_hqx() computes the same CRC (polynomial 0x1021,
+    not reflected, no final XOR) in C, about 50 times as fast.
+    """
+    return crc_hqx(data, crc)
+
+
+def crc16xmodem_blocks(data, block_size=16384):
+    """Calculate CRC16 (XModem) of each block of data.
+    `data`      - any bytes-like object
+    `block_size` - length of each block; the last may be shorter
+    Return a list of CRC values, one for each block
+    """
+    data = memoryview(data)
+    return [crc_hqx(data[i:i + block_size], 0)
+            for i in range(0, len(data), block_size)]
@@ -51,6 +51,7 @@ const char *HELP_TEXT =
 	"                         must be at least 1268\n"
 ;
 
+#ifndef DONUT_LIBRARY
 static int verbosity_level = 0;
 static void fatal_error(const char *msg)
 {
@@ -65,6 +66,7 @@ static void fatal_perror(const char *filename)
 		perror(filename);
 	exit(EXIT_FAILURE);
 }
+#endif
 
 /* According to a strace of cat on my system, and a quick dd of dev/zero:
    131072 is the optimal block size,
@@ -74,7 +76,9 @@ static void fatal_perror(const char *filename)
 #define BUF_GAP_SIZE 512
 #define BUF_TOTAL_SIZE ((BUF_IO_SIZE+BUF_GAP_SIZE)*2)
 
+#ifndef DONUT_LIBRARY
 static uint8_t byte_buffer[BUF_TOTAL_SIZE];
+#endif
 
 #define OUTPUT_BEGIN (byte_buffer)
 #define INPUT_BEGIN (byte_buffer + BUF_TOTAL_SIZE - BUF_IO_SIZE)
@@ -674,6 +678,117 @@ int compress_blocks_with_dcb(buffer_pointers *result_p, bool allow_partial, bool
 	return DESTINATION_FULL;
 }
 
+/* In-process API, for building donut.c as a shared library with
+   -DDONUT_LIBRARY.  Each call returns the number of bytes written to
+   dst, or a negative DONUT_ERR_* value. */
+enum {
+	DONUT_ERR_UNDEFINED_BLOCK = -1,
+	DONUT_ERR_PARTIAL = -2,
+	DONUT_ERR_DESTINATION_FULL = -3,
+	DONUT_ERR_NO_MEMORY = -4,
+	DONUT_ERR_CYCLE_LIMIT = -5
+};
+
+enum {
+	MODE_COMPRESS,
+	MODE_COMPRESS_DCB,
+	MODE_DECOMPRESS
+};
+
+/* Runs one of the block coders over a whole buffer.  The coders
+   work in place, with the source ahead of the destination, so copy
+   the source far enough ahead that the destination can't catch up. */
+static long run_block_coder(int mode, uint8_t *dst, size_t dst_cap,
+                            const uint8_t *src, size_t src_len,
+                            size_t dst_bound, bool flag, int cycle_limit)
+{
+	buffer_pointers p;
+	uint8_t *work;
+	size_t gap = dst_bound + 128;
+	size_t l;
+	int status;
+
+	work = malloc(gap + src_len);
+	if (work == NULL)
+		return DONUT_ERR_NO_MEMORY;
+	memcpy(work + gap, src, src_len);
+	p.dest_begin = work;
+	p.dest_end = work;
+	p.src_begin = work + gap;
+	p.src_end = work + gap + src_len;
+	if (mode == MODE_DECOMPRESS) {
+		status = decompress_blocks(&p, flag);
+	} else if (mode == MODE_COMPRESS_DCB) {
+		status = compress_blocks_with_dcb(&p, true, flag, cycle_limit);
+	} else {
+		status = compress_blocks(&p, true, flag, cycle_limit);
+	}
+	l = (size_t)(p.dest_end - p.dest_begin);
+	if (status == SOURCE_EMPTY && l <= dst_cap) {
+		memcpy(dst, p.dest_begin, l);
+	}
+	free(work);
+	switch (status) {
+	case SOURCE_EMPTY:
+		return (l <= dst_cap) ? (long)l : DONUT_ERR_DESTINATION_FULL;
+	case ENCOUNTERED_UNDEFINED_BLOCK:
+		return DONUT_ERR_UNDEFINED_BLOCK;
+	case SOURCE_IS_PARTIAL:
+		return DONUT_ERR_PARTIAL;
+	default:
+		return DONUT_ERR_DESTINATION_FULL;
+	}
+}
+
+const char *donut_version(void)
+{
+	return VERSION_TEXT;
+}
+
+/* Largest possible compressed size of src_len bytes of tile data */
+size_t donut_compress_bound(size_t src_len)
+{
+	return (src_len + 63) / 64 * 65;
+}
+
+/* Compresses src, padding a partial last block with $00 bytes.
+   cycle_limit is the most 6502 cycles to decode each block
+   (10000 in the command line tool, at least 1268). */
+long donut_compress_buffer(uint8_t *dst, size_t dst_cap,
+                           const uint8_t *src, size_t src_len,
+                           int use_bit_flip, int cycle_limit)
+{
+	if (cycle_limit < 1268)
+		return DONUT_ERR_CYCLE_LIMIT;
+	return run_block_coder(MODE_COMPRESS, dst, dst_cap, src, src_len,
+	                       donut_compress_bound(src_len),
+	                       use_bit_flip != 0, cycle_limit);
+}
+
+/* As donut_compress_buffer(), but src alternates 64-byte blocks
+   and 64-byte masks whose 1 bits mark the block's don't care bits,
+   as in --interleaved-dont-care-bits */
+long donut_compress_dcb_buffer(uint8_t *dst, size_t dst_cap,
+                               const uint8_t *src, size_t src_len,
+                               int use_bit_flip, int cycle_limit)
+{
+	if (cycle_limit < 1268)
+		return DONUT_ERR_CYCLE_LIMIT;
+	return run_block_coder(MODE_COMPRESS_DCB, dst, dst_cap, src, src_len,
+	                       donut_compress_bound((src_len + 1) / 2),
+	                       use_bit_flip != 0, cycle_limit);
+}
+
+/* Decompresses src.  The result can be up to 64 times src_len. */
+long donut_decompress_buffer(uint8_t *dst, size_t dst_cap,
+                             const uint8_t *src, size_t src_len,
+                             int allow_partial)
+{
+	return run_block_coder(MODE_DECOMPRESS, dst, dst_cap, src, src_len,
+	                       src_len * 64, allow_partial != 0, 10000);
+}
+
+#ifndef DONUT_LIBRARY
 int main (int argc, char **argv)
 {
 	int c;
@@ -964,3 +1079,4 @@ int main (int argc, char **argv)
 
 	exit(EXIT_SUCCESS);
 }
+#endif /* DONUT_LIBRARY */
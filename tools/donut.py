@@ -16,6 +16,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Version History:
+# 2026-10-17: Added DonutEncoder and DonutDecoder, which take input
+#             in chunks of any size.  The command line tool reads
+#             and writes in 64 KiB chunks through them.
+# 2026-10-17: Encoder finds the cost of each attempt type from pb8
+#             headers computed on 64-bit ints and packs only the
+#             cheapest.  Output is unchanged.  Set verify_blocks
+#             (or pass --verify) to decompress each block to check.
 # 2019-02-15: Swapped the M and L bits, for conceptual consistency.
 #             Also rearranged branches for speed.
 # 2019-02-07: Removed "Duplicate" block type, and moved
@@ -30,6 +37,10 @@
 # 2018-04-30: Initial release.
 
 import functools
+import itertools
+import operator
+
+__version__ = '1.7'
 
 """
 The coded block starts with a 1 or 2 byte header,
@@ -102,6 +113,15 @@ def flip_plane_bits_45(plane):
 def flip_plane_bits_135(plane):
     return bytes(sum(((plane[x] >> y)&0b1) << x for x in range(8)) for y in range(8))
 
+# donut.c's --cycle-limit must be at least this, which it counts as
+# the decode time of an uncompressed block, and defaults to 10000
+MIN_CYCLE_LIMIT = 1268
+DEFAULT_CYCLE_LIMIT = 10000
+
+def cblock_cycles(cblock):
+    """Estimate the 6502 cycles to decode a compressed block."""
+    return (cblock_cost(cblock) >> 8) & 0x1fff
+
 def cblock_cost(cblock):
     l = len(cblock)
     if (l < 1):
@@ -143,6 +163,31 @@ def cblock_cost(cblock):
         cycles += l * 6
     return (len(cblock)*8192 + cycles)*256 + block_header
 
+# CPU cycles that the menu's CHR loader spends beyond the decoder:
+# fetching, uploading, and looping per 64-byte block
+CHR_LOADER_BLOCK_CYCLES = 990
+
+def chr_block_cycles(cdata, num_blocks=128):
+    """Estimate the time for the menu to load each block of a CHR bank.
+
+cdata -- a bytes-like object starting with the compressed bank
+num_blocks -- number of blocks to read
+
+Return a list of (cycles, block header) for each block, counting the
+loader's time as well as the decoder's.
+"""
+    mv = memoryview(cdata)
+    pos, out = 0, []
+    for i in range(num_blocks):
+        length = cblock_length(mv, pos)
+        if length is None or mv[pos] >= 0xc0:
+            raise ValueError("block %d of %d is invalid or past the end of the bank"
+                             % (i, num_blocks))
+        cblock = mv[pos:pos + length]
+        out.append((cblock_cycles(cblock) + CHR_LOADER_BLOCK_CYCLES, cblock[0]))
+        pos += length
+    return out
+
 def decompress_single_block(cblock, allow_partial=False):
     cblock_iter = iter(cblock)
     block = bytearray(64)
@@ -273,61 +318,207 @@ def fill_dont_care_bits(plane, dont_care_mask=b'\xff'*8, top_value=0x00, xor_bg=
         prev_byte = cur_byte
     return bytes(result_plane)
 
-def compress_single_block(block, dont_care_mask=b'\xff'*64, use_bit_flip=True):
+# Set to True to decompress each compressed block and check it
+# against the input, for debugging the encoder
+verify_blocks = False
+
+# Tables for the block encoder, which holds each plane as a 64-bit
+# little-endian int so that one XOR or shift works on all 8 bytes.
+# TRANSPOSE_SPREAD[b] moves bit y of b to bit 0 of byte y.
+TRANSPOSE_SPREAD = tuple(sum(((b >> y) & 1) << (8 * y) for y in range(8))
+                         for b in range(256))
+POPCOUNT = tuple(bin(b).count("1") for b in range(256))
+# Header bits for plane_def values that need no extra header byte
+SHORT_PLANE_DEFS = {0x00: 0x00, 0x55: 0x04, 0xaa: 0x08, 0xff: 0x0c}
+# Attempt types tried by the encoder: predict from 0x00 or 0xff,
+# M = M XOR L or L = M XOR L or neither, and rotated or not
+ATTEMPT_TYPES = tuple(((t & 0x1e) << 3) | (t & 0x01) for t in range(24))
+RAW_BLOCK_COST = cblock_cost(b'\x2a' + bytes(64))
+
+def plane_to_int(plane):
+    return int.from_bytes(plane, 'little')
+
+def int_to_plane(v):
+    return v.to_bytes(8, 'little')
+
+def transpose_plane_int(plane):
+    """flip_plane_bits_135() of a plane, as an int."""
+    v = 0
+    for x, byte in enumerate(plane):
+        v |= TRANSPOSE_SPREAD[byte] << x
+    return v
+
+def pb8_flags_int(v, top_value=0x00):
+    """Find the header of pb8_pack_plane() of a plane given as an int.
+
+Bit i of the result is set if byte i differs from byte i + 1, or
+from top_value for byte 7.
+"""
+    d = v ^ ((v >> 8) | (top_value << 56))
+    d |= d >> 4
+    d |= d >> 2
+    d |= d >> 1
+    return ((d & 0x0101010101010101) * 0x0102040810204080 >> 56) & 0xFF
+
+def block_plane_pairs(block, dont_care_mask, flip):
+    """Split a block into 4 (L, M, mask L, mask M) tuples of ints.
+
+If flip, rotate the planes and masks.  Masks are None if all bits
+of both planes matter.
+"""
+    pairs = []
+    for i in range(0, 64, 16):
+        plane_l, plane_m = block[i:i + 8], block[i + 8:i + 16]
+        mask_l, mask_m = dont_care_mask[i:i + 8], dont_care_mask[i + 8:i + 16]
+        to_int = transpose_plane_int if flip else plane_to_int
+        if mask_l == mask_m == b'\xff'*8:
+            mask_l = mask_m = None
+        else:
+            mask_l, mask_m = to_int(mask_l), to_int(mask_m)
+        pairs.append((to_int(plane_l), to_int(plane_m), mask_l, mask_m))
+    return pairs
+
+def attempt_planes(pair, attempt_type, fills):
+    """Find the L and M planes that an attempt type encodes, as ints.
+
+fills -- a dict to memoize fill_dont_care_bits() results
+"""
+    plane_l, plane_m, mask_l, mask_m = pair
+    if mask_l is not None:
+        top_value_l = 0xff if attempt_type & 0x20 else 0x00
+        top_value_m = 0xff if attempt_type & 0x10 else 0x00
+        key_l, key_m = (plane_l, mask_l, top_value_l), (plane_m, mask_m, top_value_m)
+        if key_l not in fills:
+            fills[key_l] = fill_dont_care_bits(int_to_plane(plane_l),
+                                               int_to_plane(mask_l), top_value_l)
+        if key_m not in fills:
+            fills[key_m] = fill_dont_care_bits(int_to_plane(plane_m),
+                                               int_to_plane(mask_m), top_value_m)
+        plane_l, plane_m = fills[key_l], fills[key_m]
+        if attempt_type & 0x80:
+            plane_l = fill_dont_care_bits(plane_l, int_to_plane(mask_l),
+                                          top_value_l, plane_m)
+        if attempt_type & 0x40:
+            plane_m = fill_dont_care_bits(plane_m, int_to_plane(mask_m),
+                                          top_value_m, plane_l)
+        plane_l, plane_m = plane_to_int(plane_l), plane_to_int(plane_m)
+    if attempt_type & 0xc0:
+        plane_xor = plane_l ^ plane_m
+        if attempt_type & 0x80:
+            plane_l = plane_xor
+        if attempt_type & 0x40:
+            plane_m = plane_xor
+    return plane_l, plane_m
+
+def check_cycle_limit(cycle_limit):
+    if cycle_limit is not None and cycle_limit < MIN_CYCLE_LIMIT:
+        raise ValueError("cycle limit must be at least %d" % MIN_CYCLE_LIMIT)
+
+def compress_single_block(block, dont_care_mask=b'\xff'*64, use_bit_flip=True,
+                          cycle_limit=None):
+    """Compress a 64-byte block, trying each attempt type.
+
+The cost of each attempt is found from the pb8 headers alone, and
+only the cheapest is packed.  This gives the same result as packing
+them all and taking the one with the least cblock_cost().
+
+cycle_limit -- if not None, skip attempts that take more than this
+many 6502 cycles to decode, per cblock_cycles().  An uncompressed
+block is always allowed.
+"""
     if len(block) != 64 or len(dont_care_mask) != 64:
         raise ValueError("input block and \"dont care mask\" must be 64 bytes.")
-    cblock_choices = [b'\x2a' + block]
-    for t in range(24):
-        attempt_type = ((t & 0x1e) << 3) | (t & 0x01)
-        if not use_bit_flip and attempt_type & 0x01:
-            continue
-        cblock = [b'']
-        plane_def = 0
-        for plane_l, plane_m, mask_l, mask_m in ((block[i+0:i+8], block[i+8:i+16], dont_care_mask[i+0:i+8], dont_care_mask[i+8:i+16]) for i in range(0,64,16)):
-            plane_def = plane_def << 2
-            if attempt_type & 0x01:
-                plane_l, plane_m = flip_plane_bits_135(plane_l), flip_plane_bits_135(plane_m)
+    check_cycle_limit(cycle_limit)
+    block, dont_care_mask = bytes(block), bytes(dont_care_mask)
+    best_cost, best = RAW_BLOCK_COST, None
+    flags_memo, fills = {}, {}
+    for flip in (0, 1) if use_bit_flip else (0,):
+        pairs = block_plane_pairs(block, dont_care_mask, flip)
+        for attempt_type in ATTEMPT_TYPES:
+            if attempt_type & 0x01 != flip:
+                continue
             top_value_l = 0xff if attempt_type & 0x20 else 0x00
             top_value_m = 0xff if attempt_type & 0x10 else 0x00
-            if mask_l != b'\xff'*8 or mask_m != b'\xff'*8:
-                if attempt_type & 0x01:
-                    mask_l, mask_m = flip_plane_bits_135(mask_l), flip_plane_bits_135(mask_m)
-                plane_l = fill_dont_care_bits(plane_l, mask_l, top_value_l)
-                plane_m = fill_dont_care_bits(plane_m, mask_m, top_value_m)
-                if attempt_type & 0x80:
-                    plane_l = fill_dont_care_bits(plane_l, mask_l, top_value_l, plane_m)
-                if attempt_type & 0x40:
-                    plane_m = fill_dont_care_bits(plane_m, mask_m, top_value_m, plane_l)
-            if attempt_type & 0xc0 != 0x00:
-                plane_xor = bytes(l^m for l , m in zip(plane_l, plane_m))
-                if attempt_type & 0x80:
-                    plane_l = plane_xor
-                if attempt_type & 0x40:
-                    plane_m = plane_xor
-            cplane_l = pb8_pack_plane(plane_l, top_value_l)
-            if cplane_l != b'\x00':
-                cblock.append(cplane_l)
-                plane_def = plane_def | 2
-            cplane_m = pb8_pack_plane(plane_m, top_value_m)
-            if cplane_m != b'\x00':
-                cblock.append(cplane_m)
-                plane_def = plane_def | 1
-        short_planes_type = next((i for i, t in enumerate([0x00,0x55,0xaa,0xff]) if plane_def == t), -1)
-        if short_planes_type < 0:
-            attempt_type |= 0x02
-            cblock[0] = bytes([attempt_type, plane_def])
-        else:
-            attempt_type |= (short_planes_type << 2)
-            cblock[0] = bytes([attempt_type])
-        cblock_result = b''.join(cblock)
+            planes = [attempt_planes(pair, attempt_type, fills) for pair in pairs]
+            plane_def = num_bytes = 0
+            for plane_l, plane_m in planes:
+                flags_l = flags_memo.get((plane_l, top_value_l))
+                if flags_l is None:
+                    flags_l = flags_memo[plane_l, top_value_l] = pb8_flags_int(plane_l, top_value_l)
+                flags_m = flags_memo.get((plane_m, top_value_m))
+                if flags_m is None:
+                    flags_m = flags_memo[plane_m, top_value_m] = pb8_flags_int(plane_m, top_value_m)
+                plane_def = (plane_def << 2) | (2 if flags_l else 0) | (1 if flags_m else 0)
+                num_bytes += POPCOUNT[flags_l] + POPCOUNT[flags_m]
+
+            # Same as cblock_cost() of the packed block
+            pb8_count = POPCOUNT[plane_def]
+            cycles = 1281 + num_bytes * 6 + pb8_count * (614 if flip else 75)
+            if attempt_type & 0xc0:
+                cycles += 640
+            if attempt_type & 0x20:
+                cycles += 4
+            if attempt_type & 0x10:
+                cycles += 4
+            length = 1 + pb8_count + num_bytes
+            header = SHORT_PLANE_DEFS.get(plane_def)
+            if header is None:
+                header = attempt_type | 0x02
+                length += 1
+                cycles += 5
+            else:
+                header |= attempt_type
+            if cycle_limit is not None and cycles > cycle_limit:
+                continue
+            cost = (length*8192 + cycles)*256 + header
+            if cost < best_cost:
+                best_cost = cost
+                best = (header, plane_def, planes, top_value_l, top_value_m)
+
+    if best is None:
+        return b'\x2a' + block
+    header, plane_def, planes, top_value_l, top_value_m = best
+    cblock = [bytes([header, plane_def]) if header & 0x02 else bytes([header])]
+    for plane_l, plane_m in planes:
+        cplane_l = pb8_pack_plane(int_to_plane(plane_l), top_value_l)
+        if cplane_l != b'\x00':
+            cblock.append(cplane_l)
+        cplane_m = pb8_pack_plane(int_to_plane(plane_m), top_value_m)
+        if cplane_m != b'\x00':
+            cblock.append(cplane_m)
+    result = b''.join(cblock)
+    if verify_blocks:
         if dont_care_mask == b'\xff'*64:
-            assert block == decompress_single_block(cblock_result)[0]
+            assert block == decompress_single_block(result)[0]
         else:
-            assert bytes(i&m for i, m in zip(block, dont_care_mask)) == bytes(i&m for i, m in zip(decompress_single_block(cblock_result)[0], dont_care_mask))
-        cblock_choices.append(cblock_result)
-    result = min(cblock_choices, key=cblock_cost)
+            assert bytes(i&m for i, m in zip(block, dont_care_mask)) == bytes(i&m for i, m in zip(decompress_single_block(result)[0], dont_care_mask))
     return result
 
+# Tile data repeats a lot: blank tiles, borders, and fonts shared
+# among activities.  compress_block() compresses each distinct block
+# once, keeping the most recently used BLOCK_CACHE_SIZE results.
+BLOCK_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=BLOCK_CACHE_SIZE)
+def _compress_block_cached(block, dont_care_mask, use_bit_flip, cycle_limit):
+    return compress_single_block(block, dont_care_mask, use_bit_flip,
+                                 cycle_limit)
+
+def compress_block(block, dont_care_mask=b'\xff'*64, use_bit_flip=True,
+                   cycle_limit=None):
+    """compress_single_block() through an LRU cache."""
+    return _compress_block_cached(bytes(block), bytes(dont_care_mask),
+                                  bool(use_bit_flip), cycle_limit)
+
+def block_cache_info():
+    """Return a dict of compress_block() cache hits, misses, and size."""
+    info = _compress_block_cached.cache_info()
+    return {'hits': info.hits, 'misses': info.misses,
+            'size': info.currsize}
+
+def block_cache_clear():
+    _compress_block_cached.cache_clear()
+
 def get_blocks_from_compressed_bytes(cblock_iter, number_of_blocks=float("inf"), allow_partial=False):
     cblock_iter = iter(cblock_iter)
     total_bytes_processed = 0
@@ -343,11 +534,11 @@ def get_blocks_from_compressed_bytes(cblock_iter, number_of_blocks=float("inf"),
         yield block
         total_blocks += 1
 
-def get_cblocks_from_bytes(block_iter, number_of_blocks=float("inf"), use_bit_flip=True, allow_partial=False):
+def get_cblocks_from_bytes(block_iter, number_of_blocks=float("inf"), use_bit_flip=True, allow_partial=False, cycle_limit=None):
     block_iter = iter(block_iter)
     total_blocks = 0
     while total_blocks < number_of_blocks:
-        block = bytes(i for _, i in zip(range(64), block_iter))
+        block = bytes(itertools.islice(block_iter, 64))
         block_len = len(block)
         if block_len == 0:
             break
@@ -359,18 +550,248 @@ def get_cblocks_from_bytes(block_iter, number_of_blocks=float("inf"), use_bit_fl
                 block_mask = b'\xff'*block_len + b'\x00'*(64-block_len)
         else:
             block_mask = b'\xff'*64
-        yield compress_single_block(block, block_mask, use_bit_flip)
+        yield compress_block(block, block_mask, use_bit_flip, cycle_limit)
         total_blocks += 1
 
-def compress(data, use_bit_flip=True, allow_partial=False):
-    return b''.join(get_cblocks_from_bytes(data, use_bit_flip=use_bit_flip, allow_partial=allow_partial))
+def compress(data, use_bit_flip=True, allow_partial=False, cycle_limit=None):
+    data = bytes(data)
+    whole_len = len(data) - len(data) % 64
+    cblocks = [compress_block(data[i:i + 64], b'\xff'*64, use_bit_flip, cycle_limit)
+               for i in range(0, whole_len, 64)]
+    if whole_len < len(data):
+        cblocks.extend(get_cblocks_from_bytes(data[whole_len:], use_bit_flip=use_bit_flip, allow_partial=allow_partial, cycle_limit=cycle_limit))
+    return b''.join(cblocks)
+
+def _pb8_sources(flags):
+    sources, n = [0] * 8, 0
+    for i in range(7, -1, -1):
+        if flags & (1 << i):
+            n += 1
+        sources[i] = n
+    return sources
+
+# PB8_EXPAND[flags] picks the 8 bytes of a plane from a pb8 packet
+# with this header byte, given as (top value, data byte 1, ...)
+PB8_EXPAND = tuple(operator.itemgetter(*_pb8_sources(flags))
+                   for flags in range(256))
+PLANE_DEF_FROM_HEADER = (0x00, 0x55, 0xaa, 0xff)
+
+def decompress_blocks(data, num_blocks=None, allow_partial=False):
+    """Decompress blocks from a bytes-like object.
+
+This does the same as get_blocks_from_compressed_bytes(), but it
+indexes into a memoryview of data instead of pulling each byte
+through an iterator, and it writes into one preallocated bytearray.
+
+num_blocks -- stop after this many blocks, or None to decompress
+    all of data
+
+Return (bytearray of decompressed blocks, number of bytes of data
+that were used).
+"""
+    mv = memoryview(data).cast('B')
+    data_len = len(mv)
+    if num_blocks is None:
+        num_blocks = data_len  # a block is at least 1 byte
+    out = bytearray(64 * min(num_blocks, data_len))
+    pos = outpos = blocks = 0
+    while blocks < num_blocks and pos < data_len:
+        start = pos
+        block_header = mv[pos]
+        pos += 1
+        try:
+            if block_header >= 0xc0:
+                raise IndexError
+            if block_header == 0x2a:
+                if pos + 64 > data_len:
+                    raise IndexError
+                out[outpos:outpos + 64] = mv[pos:pos + 64]
+                pos += 64
+            else:
+                if block_header & 0x02:
+                    plane_def = mv[pos]
+                    pos += 1
+                    single_plane = block_header & 0x04 and plane_def
+                else:
+                    plane_def = PLANE_DEF_FROM_HEADER[(block_header >> 2) & 0x03]
+                    single_plane = False
+                if single_plane:
+                    flags = mv[pos]
+                    end = pos + 1 + POPCOUNT[flags]
+                    if end > data_len:
+                        raise IndexError
+                    pb8_bytes = mv[pos + 1:end]
+                    pos = end
+                top_value_l = 0xff if block_header & 0x20 else 0x00
+                top_value_m = 0xff if block_header & 0x10 else 0x00
+                for k in range(8):
+                    top_value = top_value_m if k & 1 else top_value_l
+                    o = outpos + 8 * k
+                    if plane_def & (0x80 >> k):
+                        if not single_plane:
+                            flags = mv[pos]
+                            end = pos + 1 + POPCOUNT[flags]
+                            if end > data_len:
+                                raise IndexError
+                            pb8_bytes = mv[pos + 1:end]
+                            pos = end
+                        plane = bytes(PB8_EXPAND[flags]((top_value, *pb8_bytes)))
+                        if block_header & 0x01:
+                            plane = int_to_plane(transpose_plane_int(plane))
+                        out[o:o + 8] = plane
+                    elif top_value:
+                        out[o:o + 8] = b'\xff'*8
+                    # else leave the plane 0x00 as preallocated
+                    if k & 1 and block_header & 0xc0:
+                        plane_xor = int_to_plane(plane_to_int(out[o - 8:o])
+                                                 ^ plane_to_int(out[o:o + 8]))
+                        if block_header & 0x80:
+                            out[o - 8:o] = plane_xor
+                        if block_header & 0x40:
+                            out[o:o + 8] = plane_xor
+        except IndexError:
+            # Let the byte-at-a-time decoder report the error or
+            # decode what it can of a partial block
+            try:
+                block, used = decompress_single_block(iter(mv[start:]), allow_partial)
+            except ValueError as error:
+                raise ValueError("At byte {}, for block {}: {}".format(start + error.args[1], blocks, error.args[0])) from error
+            out[outpos:outpos + 64] = block
+            outpos += 64
+            pos = start + used
+            break
+        outpos += 64
+        blocks += 1
+    del out[outpos:]
+    return out, pos
 
 def decompress(data, allow_partial=False):
-    return b''.join(get_blocks_from_compressed_bytes(data, allow_partial=allow_partial))
+    return bytes(decompress_blocks(data, allow_partial=allow_partial)[0])
+
+def cblock_length(data, pos=0):
+    """Find the length of the compressed block at data[pos:].
+
+Return the length in bytes, or None if data ends before the block
+does.  A reserved header (0xc0 or more) counts as a 1-byte block,
+which decompress_blocks() will reject.
+"""
+    data_len = len(data)
+    if pos >= data_len:
+        return None
+    block_header = data[pos]
+    if block_header >= 0xc0:
+        return 1
+    if block_header == 0x2a:
+        return 65 if pos + 65 <= data_len else None
+    end = pos + 1
+    if block_header & 0x02:
+        if end >= data_len:
+            return None
+        plane_def = data[end]
+        end += 1
+        num_planes = 1 if block_header & 0x04 and plane_def else POPCOUNT[plane_def]
+    else:
+        num_planes = POPCOUNT[PLANE_DEF_FROM_HEADER[(block_header >> 2) & 0x03]]
+    for i in range(num_planes):
+        if end >= data_len:
+            return None
+        end += 1 + POPCOUNT[data[end]]
+    return end - pos if end <= data_len else None
+
+class DonutEncoder(object):
+    """Compress tile data given in chunks of any size.
+
+Each call to feed() compresses the whole 64-byte blocks received so
+far and returns them.  flush() compresses what remains, or raises
+ValueError if a partial block remains and allow_partial is false.
+
+encode_fn -- a function taking a byte string of tile data and
+    returning it compressed, such as donutlib.compress, or None to
+    use compress() with these options
+"""
+
+    def __init__(self, use_bit_flip=True, allow_partial=False,
+                 cycle_limit=None, encode_fn=None):
+        check_cycle_limit(cycle_limit)
+        self.allow_partial = allow_partial
+        self.encode_fn = encode_fn or functools.partial(
+            compress, use_bit_flip=use_bit_flip, allow_partial=True,
+            cycle_limit=cycle_limit
+        )
+        self.pending = bytearray()
+
+    def feed(self, data):
+        """Add tile data and return compressed data for whole blocks."""
+        self.pending.extend(data)
+        whole_len = len(self.pending) - len(self.pending) % 64
+        if not whole_len:
+            return b''
+        blocks = bytes(self.pending[:whole_len])
+        del self.pending[:whole_len]
+        return self.encode_fn(blocks)
+
+    def flush(self):
+        """Return compressed data for the partial last block, if any."""
+        if not self.pending:
+            return b''
+        if not self.allow_partial:
+            raise ValueError("Last block is less than 64 bytes.")
+        blocks = bytes(self.pending)
+        self.pending.clear()
+        return self.encode_fn(blocks)
+
+class DonutDecoder(object):
+    """Decompress Donut data given in chunks of any size.
+
+Each call to feed() decompresses the whole blocks received so far
+and returns them.  flush() decompresses what remains as a partial
+block if allow_partial is true, or raises ValueError if any remains.
+
+decode_fn -- a function taking a byte string of compressed data and
+    allow_partial and returning it decompressed, such as
+    donutlib.decompress, or None to use decompress()
+"""
+
+    def __init__(self, allow_partial=False, decode_fn=None):
+        self.allow_partial = allow_partial
+        self.decode_fn = decode_fn or decompress
+        self.pending = bytearray()
+        self.bytes_in = self.blocks_out = 0
+
+    def feed(self, data):
+        """Add compressed data and return decompressed whole blocks."""
+        self.pending.extend(data)
+        end = 0
+        while True:
+            length = cblock_length(self.pending, end)
+            if length is None:
+                break
+            end += length
+        if not end:
+            return b''
+        cblocks = bytes(self.pending[:end])
+        del self.pending[:end]
+        return self._decode(cblocks, False)
+
+    def flush(self):
+        """Return the decompressed partial last block, if any."""
+        if not self.pending:
+            return b''
+        cblocks = bytes(self.pending)
+        self.pending.clear()
+        return self._decode(cblocks, self.allow_partial)
+
+    def _decode(self, cblocks, allow_partial):
+        try:
+            out = self.decode_fn(cblocks, allow_partial)
+        except ValueError as error:
+            raise ValueError("{} (counting from byte {}, block {})".format(error, self.bytes_in, self.blocks_out)) from error
+        self.bytes_in += len(cblocks)
+        self.blocks_out += len(out) // 64
+        return out
 
 import sys
 import os
-import itertools
 
 class FileIterContextHack():
     def __init__(self, fn, mode, ask_file_overwrite=True):
@@ -428,19 +849,36 @@ class FileIterContextHack():
         self.bytes_transfered += number_written
         return number_written
 
+# Bytes read from each input file at a time
+CHUNK_SIZE = 65536
+
 def main(argv=None):
     import sys
     import argparse
 
     parser = argparse.ArgumentParser(description='Donut NES Codec', usage='%(prog)s [options] [-d] input [-o] output')
-    parser.add_argument('--version', action='version', version='%(prog)s 1.7')
+    parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
     parser.add_argument('input', metavar='files', help='Input files', nargs='*')
     parser.add_argument('-d', '--decompress', help='decompress the input files', action='store_true')
     parser.add_argument('-o', '--output', metavar='FILE', help='output to FILE instead of last positional argument')
     parser.add_argument('-f', '--force',  help='overwrite output without prompting', action='store_true')
     parser.add_argument('-q', '--quiet', help='suppress messages and completion stats', action="store_true")
     parser.add_argument('--no-bit-flip', help="don't encode plane flipping", action="store_true")
+    parser.add_argument('--pure-python', help="don't use the compiled Donut library even if built", action="store_true")
+    parser.add_argument('--verify', help="decompress each block after compressing it (pure Python only)", action="store_true")
+    parser.add_argument('--cycle-limit', metavar='INT', type=int, default=DEFAULT_CYCLE_LIMIT, help="limit the 6502 decoding time for each encoded block, must be at least %d" % MIN_CYCLE_LIMIT)
     options = parser.parse_args(argv)
+    global verify_blocks
+    verify_blocks = options.verify
+    try:
+        check_cycle_limit(options.cycle_limit)
+    except ValueError as e:
+        parser.error(str(e))
+
+    native = False
+    if not options.pure_python:
+        import donutlib
+        native = donutlib.native
 
     if not options.output and len(options.input) > 1:
         options.output = options.input.pop()
@@ -461,25 +899,13 @@ def main(argv=None):
         for fn in options.input:
             with FileIterContextHack(fn, 'rb') as input_file:
                 if options.decompress:
-                    page = []
-                    for block in get_blocks_from_compressed_bytes(input_file):
-                        page.append(block)
-                        if len(page) >= 128:
-                            output_file.write(b''.join(page))
-                            page.clear()
-                    if len(page) > 0:
-                        output_file.write(b''.join(page))
-                        page.clear()
+                    coder = DonutDecoder(decode_fn=donutlib.decompress if native else None)
                 else:
-                    page = []
-                    for block in get_cblocks_from_bytes(input_file, use_bit_flip=(not options.no_bit_flip), allow_partial=True):
-                        page.append(block)
-                        if len(page) >= 128:
-                            output_file.write(b''.join(page))
-                            page.clear()
-                    if len(page) > 0:
-                        output_file.write(b''.join(page))
-                        page.clear()
+                    coder = DonutEncoder(use_bit_flip=(not options.no_bit_flip), allow_partial=True, cycle_limit=options.cycle_limit,
+                                         encode_fn=functools.partial(donutlib.compress, use_bit_flip=(not options.no_bit_flip), cycle_limit=options.cycle_limit) if native else None)
+                for chunk in iter(lambda: input_file.read(CHUNK_SIZE), b''):
+                    output_file.write(coder.feed(chunk))
+                output_file.write(coder.flush())
                 if not options.quiet:
                     r = input_file.bytes_transfered
                     w = output_file.bytes_transfered - total_output_bytes
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+In-process interface to the C Donut encoder
+Copyright 2026 Action 53 contributors
+zlib license
+
+Running the donut executable once per CHR bank or screenshot means
+spawning hundreds of processes per build.  Instead, `make` can build
+donut.c as a shared library (libdonut.so, libdonut.dylib, or
+libdonut.dll next to this file), which this module loads with ctypes.
+Set the DONUT_LIBRARY environment variable to load it from elsewhere.
+
+If the library can't be loaded, the same functions fall back to the
+pure-Python codec in donut.py, encoding with the NumPy batch encoder
+in donutnp.py if NumPy is installed.  Check `native` to see which is
+in use, and include `codec_id` in any cache key, as the C and Python
+encoders can produce different (equally valid) output.
+"""
+import os
+import sys
+import ctypes
+import donut
+try:
+    import donutnp
+except ImportError:
+    donutnp = None
+
+DONUT_ERRORS = {
+    -1: "block header >= 0xc0 (currently reserved)",
+    -2: "unexpected end of data",
+    -3: "output buffer full",
+    -4: "out of memory",
+    -5: "cycle limit must be at least 1268",
+}
+
+# Cycle limit used by the donut command line tool
+DEFAULT_CYCLE_LIMIT = donut.DEFAULT_CYCLE_LIMIT
+
+def _load_library():
+    names = [os.environ.get('DONUT_LIBRARY')]
+    libdir = os.path.dirname(os.path.abspath(__file__))
+    names.extend(os.path.join(libdir, 'libdonut' + ext)
+                 for ext in ('.so', '.dylib', '.dll'))
+    for name in names:
+        if not name or not os.path.exists(name):
+            continue
+        try:
+            lib = ctypes.CDLL(name)
+        except OSError as e:
+            print("%s: %s" % (name, e), file=sys.stderr)
+            continue
+        buf_args = [ctypes.c_char_p, ctypes.c_size_t,
+                    ctypes.c_char_p, ctypes.c_size_t]
+        lib.donut_version.restype = ctypes.c_char_p
+        lib.donut_version.argtypes = []
+        lib.donut_compress_bound.restype = ctypes.c_size_t
+        lib.donut_compress_bound.argtypes = [ctypes.c_size_t]
+        for fn in (lib.donut_compress_buffer, lib.donut_compress_dcb_buffer):
+            fn.restype = ctypes.c_long
+            fn.argtypes = buf_args + [ctypes.c_int, ctypes.c_int]
+        lib.donut_decompress_buffer.restype = ctypes.c_long
+        lib.donut_decompress_buffer.argtypes = buf_args + [ctypes.c_int]
+        return lib
+    return None
+
+_lib = _load_library()
+native = _lib is not None
+if native:
+    codec_id = _lib.donut_version().decode('ascii').strip() + ' (C)'
+else:
+    codec_id = 'donut.py %s' % donut.__version__
+
+def _call(fn, dst_cap, data, *args):
+    data = bytes(data)
+    dst = ctypes.create_string_buffer(dst_cap)
+    result = fn(dst, dst_cap, data, len(data), *args)
+    if result < 0:
+        raise ValueError(DONUT_ERRORS.get(result, "error %d" % result))
+    return dst.raw[:result]
+
+def _dcb_to_care_mask(mask):
+    """Invert an interleaved don't care mask into donut.py's sense."""
+    return bytes(x ^ 0xFF for x in mask)
+
+def compress(data, use_bit_flip=True, cycle_limit=DEFAULT_CYCLE_LIMIT):
+    """Compress tile data, padding a partial last block with $00.
+
+cycle_limit -- most 6502 cycles to decode each block
+"""
+    if not native:
+        if donutnp:
+            return donutnp.compress(data, use_bit_flip, True, cycle_limit)
+        return donut.compress(data, use_bit_flip, True, cycle_limit)
+    return _call(_lib.donut_compress_buffer,
+                 _lib.donut_compress_bound(len(data)), data,
+                 int(use_bit_flip), cycle_limit)
+
+def compress_with_dont_care(data, use_bit_flip=True,
+                            cycle_limit=DEFAULT_CYCLE_LIMIT):
+    """Compress blocks whose don't care bits are given by masks.
+
+data -- alternating 64-byte blocks and 64-byte masks, where 1 bits in
+    the mask mark bits of the block whose decoded value doesn't
+    matter (the donut tool's --interleaved-dont-care-bits format)
+cycle_limit -- most 6502 cycles to decode each block
+"""
+    if not native and donutnp:
+        data = bytes(data)
+        blocks = b''.join(data[i:i + 64] for i in range(0, len(data), 128))
+        masks = b''.join(data[i + 64:i + 128] for i in range(0, len(data), 128))
+        return donutnp.compress_blocks(blocks, _dcb_to_care_mask(masks),
+                                       use_bit_flip, cycle_limit)
+    if not native:
+        return b''.join(
+            donut.compress_block(
+                bytes(data[i:i + 64]),
+                _dcb_to_care_mask(data[i + 64:i + 128]), use_bit_flip,
+                cycle_limit
+            ) for i in range(0, len(data), 128)
+        )
+    return _call(_lib.donut_compress_dcb_buffer,
+                 _lib.donut_compress_bound((len(data) + 1) // 2), data,
+                 int(use_bit_flip), cycle_limit)
+
+# Block cache hits and misses in worker processes, as reported to
+# add_block_cache_counts()
+_worker_block_counts = {'hits': 0, 'misses': 0}
+
+def _local_block_cache_info():
+    if native:
+        return None
+    if donutnp:
+        return donutnp.dedup_info()
+    return donut.block_cache_info()
+
+def block_cache_info():
+    """Count blocks that the Python encoder reused or encoded.
+
+Return a dict with 'hits' and 'misses' of donut.compress_block()'s
+cache, or of donutnp's blocks that repeat within one call if NumPy
+is in use, counting worker processes that reported through
+add_block_cache_counts().  Return None if the C library is in use.
+"""
+    info = _local_block_cache_info()
+    if info is None:
+        return None
+    info = dict(info)
+    for k, v in _worker_block_counts.items():
+        info[k] += v
+    return info
+
+def call_counting_blocks(fn, arg):
+    """Call fn(arg) in a worker process.
+
+Return (result, counts), where counts is a dict of block cache hits
+and misses during the call, or None if the C library is in use.
+"""
+    before = _local_block_cache_info()
+    result = fn(arg)
+    if before is None:
+        return result, None
+    after = _local_block_cache_info()
+    return result, {k: after[k] - before[k] for k in _worker_block_counts}
+
+def add_block_cache_counts(counts):
+    """Add counts from call_counting_blocks() to block_cache_info()."""
+    for k, v in (counts or {}).items():
+        _worker_block_counts[k] += v
+
+def decompress(data, allow_partial=False):
+    """Decompress Donut data."""
+    if not native:
+        return donut.decompress(data, allow_partial)
+    return _call(_lib.donut_decompress_buffer, len(data) * 64, data,
+                 int(allow_partial))
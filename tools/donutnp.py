@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Batch Donut encoder using NumPy
+Copyright 2026 Action 53 contributors
+zlib license
+
+donut.compress_single_block() tries 24 ways to code each 64-byte
+block one block at a time.  This module does the same arithmetic
+on all blocks of a CHR bank or screenshot set at once, as an (N, 64)
+array: rotating planes, filling don't care bits, XORing planes,
+finding pb8 headers, and costing each attempt type as cblock_cost()
+would.  It then packs the cheapest attempt for each block.
+
+The output is the same as donut.py's, so donutlib uses this module
+when libdonut isn't built and NumPy is installed.  Importing it
+raises ImportError if NumPy is missing.
+"""
+import numpy as np
+import donut
+
+POPCOUNT = np.array(donut.POPCOUNT, dtype=np.int64)
+SHORT_HEADER = np.full(256, -1, dtype=np.int64)
+for plane_def, header in donut.SHORT_PLANE_DEFS.items():
+    SHORT_HEADER[plane_def] = header
+del plane_def, header
+
+# Weight of each plane's bit in plane_def: L0 M0 L1 M1 ... from MSB
+PLANE_DEF_BITS = np.array([0x80 >> k for k in range(8)], dtype=np.int64)
+
+# Blocks that compress_blocks() found repeated (hits) or encoded
+# (misses), in the form of donut.block_cache_info()
+_dedup_counts = {'hits': 0, 'misses': 0}
+
+def dedup_info():
+    """Return a dict of blocks that compress_blocks() reused or encoded."""
+    return dict(_dedup_counts)
+
+def transpose_planes(planes):
+    """Rotate each 8x8 plane of an (..., 8) uint8 array.
+
+Same as donut.flip_plane_bits_135() on each plane.
+"""
+    bits = np.unpackbits(planes[..., None], axis=-1, bitorder='little')
+    return np.packbits(np.swapaxes(bits, -1, -2), axis=-1,
+                       bitorder='little')[..., 0]
+
+def fill_dont_care_bits(planes, masks, top_value, xor_bg=None):
+    """Vectorized donut.fill_dont_care_bits() on (..., 8) uint8 arrays.
+
+Where a mask is all 0xff the plane is unchanged, as in donut.py.
+"""
+    if xor_bg is None:
+        xor_bg = np.zeros_like(planes)
+    not_masks = ~masks
+    smudge = np.empty_like(planes)
+    cur = np.full(planes.shape[:-1], top_value, dtype=np.uint8)
+    for i in range(8):
+        mask, not_mask = masks[..., i], not_masks[..., i]
+        cur = (planes[..., i] & mask) | (cur & not_mask)
+        smudge[..., i] = (cur & mask) | ((cur ^ xor_bg[..., i]) & not_mask)
+    result = np.empty_like(planes)
+    prev = np.full(planes.shape[:-1], top_value, dtype=np.uint8)
+    for i in range(7, -1, -1):
+        mask, not_mask = masks[..., i], not_masks[..., i]
+        new = planes[..., i] & mask
+        cur = np.where(new == (prev & mask), new | (prev & not_mask),
+                       new | (smudge[..., i] & not_mask))
+        result[..., i] = (cur & mask) | ((cur ^ xor_bg[..., i]) & not_mask)
+        prev = cur
+    return result
+
+def pb8_flags(planes, top_values):
+    """Find pb8 headers of (..., 8) uint8 planes.
+
+top_values -- a value for the byte above each plane, broadcast
+    against planes[..., 0]
+
+Return an int64 array of headers and a bool array of which bytes
+differ from the byte above them.
+"""
+    above = np.empty_like(planes)
+    above[..., :7] = planes[..., 1:]
+    above[..., 7] = top_values
+    differs = planes != above
+    flags = np.packbits(differs, axis=-1, bitorder='little')[..., 0]
+    return flags.astype(np.int64), differs
+
+def attempt_planes(plane_l, plane_m, mask_l, mask_m, attempt_type):
+    """Find the L and M planes that an attempt type codes.
+
+All arguments but attempt_type are (N, 4, 8) uint8 arrays, or
+masks may be None if all bits matter.
+"""
+    top_value_l = 0xff if attempt_type & 0x20 else 0x00
+    top_value_m = 0xff if attempt_type & 0x10 else 0x00
+    if mask_l is not None:
+        plane_l = fill_dont_care_bits(plane_l, mask_l, top_value_l)
+        plane_m = fill_dont_care_bits(plane_m, mask_m, top_value_m)
+        if attempt_type & 0x80:
+            plane_l = fill_dont_care_bits(plane_l, mask_l, top_value_l, plane_m)
+        if attempt_type & 0x40:
+            plane_m = fill_dont_care_bits(plane_m, mask_m, top_value_m, plane_l)
+    if attempt_type & 0xc0:
+        plane_xor = plane_l ^ plane_m
+        if attempt_type & 0x80:
+            plane_l = plane_xor
+        if attempt_type & 0x40:
+            plane_m = plane_xor
+    return plane_l, plane_m
+
+def compress_blocks(blocks, dont_care_masks=None, use_bit_flip=True,
+                    cycle_limit=None):
+    """Compress whole 64-byte blocks.
+
+blocks -- a bytes-like object whose length is a multiple of 64
+dont_care_masks -- bytes-like object of the same length, where 0 bits
+    mark bits of blocks whose decoded value doesn't matter (the sense
+    of donut.compress_single_block()), or None if all bits matter
+cycle_limit -- most 6502 cycles to decode each block, or None
+
+Return the same as joining compress_single_block() of each block.
+"""
+    donut.check_cycle_limit(cycle_limit)
+    blocks = np.frombuffer(bytes(blocks), dtype=np.uint8).reshape(-1, 64)
+    if dont_care_masks is None:
+        masks = None
+        rows = blocks
+    else:
+        masks = np.frombuffer(bytes(dont_care_masks),
+                              dtype=np.uint8).reshape(-1, 64)
+        rows = np.concatenate((blocks, masks), axis=1)
+    if len(blocks) == 0:
+        return b''
+
+    # Tile data repeats a lot, so encode each distinct block once
+    rows, inverse = np.unique(rows, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    blocks = rows[:, :64]
+    _dedup_counts['hits'] += len(inverse) - len(blocks)
+    _dedup_counts['misses'] += len(blocks)
+    if masks is not None:
+        masks = rows[:, 64:]
+        if (masks == 0xff).all():
+            masks = None
+    n = len(blocks)
+
+    best_cost = np.full(n, donut.RAW_BLOCK_COST, dtype=np.int64)
+    best_header = np.full(n, 0x2a, dtype=np.int64)
+    best_plane_def = np.zeros(n, dtype=np.int64)
+    best_planes = np.zeros((n, 8, 8), dtype=np.uint8)
+    best_tops = np.zeros((n, 8), dtype=np.uint8)
+
+    for flip in (0, 1) if use_bit_flip else (0,):
+        planes = blocks.reshape(n, 8, 8)
+        if flip:
+            planes = transpose_planes(planes)
+        plane_l, plane_m = planes[:, 0::2], planes[:, 1::2]
+        mask_l = mask_m = None
+        if masks is not None:
+            mask_planes = masks.reshape(n, 8, 8)
+            if flip:
+                mask_planes = transpose_planes(mask_planes)
+            mask_l, mask_m = mask_planes[:, 0::2], mask_planes[:, 1::2]
+
+        for attempt_type in donut.ATTEMPT_TYPES:
+            if attempt_type & 0x01 != flip:
+                continue
+            top_value_l = 0xff if attempt_type & 0x20 else 0x00
+            top_value_m = 0xff if attempt_type & 0x10 else 0x00
+            coded_l, coded_m = attempt_planes(plane_l, plane_m,
+                                              mask_l, mask_m, attempt_type)
+            # Interleave back to (n, 8 planes, 8 bytes)
+            coded = np.empty((n, 8, 8), dtype=np.uint8)
+            coded[:, 0::2], coded[:, 1::2] = coded_l, coded_m
+            tops = np.array([top_value_l, top_value_m] * 4, dtype=np.uint8)
+            flags = pb8_flags(coded, tops)[0]
+
+            # Same as cblock_cost() of the packed block
+            plane_def = ((flags != 0) * PLANE_DEF_BITS).sum(axis=1)
+            num_bytes = POPCOUNT[flags].sum(axis=1)
+            pb8_count = POPCOUNT[plane_def]
+            cycles = (1281 + num_bytes * 6
+                      + pb8_count * (614 if flip else 75))
+            if attempt_type & 0xc0:
+                cycles += 640
+            if attempt_type & 0x20:
+                cycles += 4
+            if attempt_type & 0x10:
+                cycles += 4
+            length = 1 + pb8_count + num_bytes
+            short_header = SHORT_HEADER[plane_def]
+            is_long = short_header < 0
+            header = np.where(is_long, attempt_type | 0x02,
+                              short_header | attempt_type)
+            length += is_long
+            cycles += 5 * is_long
+            cost = (length * 8192 + cycles) * 256 + header
+
+            better = cost < best_cost
+            if cycle_limit is not None:
+                better &= cycles <= cycle_limit
+            best_cost[better] = cost[better]
+            best_header[better] = header[better]
+            best_plane_def[better] = plane_def[better]
+            best_planes[better] = coded[better]
+            best_tops[better] = tops
+
+    cblocks = pack_blocks(blocks, best_header, best_plane_def,
+                          best_planes, best_tops)
+    return b''.join([cblocks[i] for i in inverse.tolist()])
+
+def pack_blocks(blocks, headers, plane_defs, planes, tops):
+    """Pack each block as its chosen attempt.
+
+headers, plane_defs -- header and plane_def of each block, where
+    header 0x2a means store the block uncompressed
+planes -- (n, 8, 8) uint8 array of the planes to code
+tops -- (n, 8) uint8 array of the top value of each plane
+
+Return a list of byte strings, one for each block.
+"""
+    n = len(blocks)
+    is_raw = headers == 0x2a
+    is_long = ((headers & 0x02) != 0) & ~is_raw
+    flags, differs = pb8_flags(planes, tops)
+
+    # Lay out every byte that each block might use, then keep those
+    # it does.  A coded plane is its pb8 header, then bytes 7 to 0
+    # of the plane where they differ from the byte above.
+    frame = np.zeros((n, 2 + 8 * 9 + 65), dtype=np.uint8)
+    keep = np.zeros(frame.shape, dtype=bool)
+    frame[:, 0], keep[:, 0] = headers, ~is_raw
+    frame[:, 1], keep[:, 1] = plane_defs, is_long
+    plane_bytes = frame[:, 2:74].reshape(n, 8, 9)
+    plane_keep = keep[:, 2:74].reshape(n, 8, 9)
+    plane_bytes[:, :, 0] = flags
+    plane_bytes[:, :, 1:] = planes[:, :, ::-1]
+    plane_keep[:, :, 0] = flags != 0
+    plane_keep[:, :, 1:] = differs[:, :, ::-1]
+    plane_keep &= ~is_raw[:, None, None]
+    frame[:, 74], frame[:, 75:] = 0x2a, blocks
+    keep[:, 74:] = is_raw[:, None]
+
+    data = frame[keep].tobytes()
+    ends = np.cumsum(keep.sum(axis=1)).tolist()
+    return [data[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+def compress(data, use_bit_flip=True, allow_partial=False, cycle_limit=None):
+    """Compress tile data as donut.compress() does."""
+    data = bytes(data)
+    partial = len(data) % 64
+    if not partial:
+        return compress_blocks(data, None, use_bit_flip, cycle_limit)
+    if not allow_partial:
+        raise ValueError("Last block is less than 64 bytes.")
+    masks = b'\xff' * len(data) + b'\x00' * (64 - partial)
+    return compress_blocks(data + bytes(64 - partial), masks, use_bit_flip,
+                           cycle_limit)
@@ -144,9 +144,154 @@ def dte_newsymbol(lines, replacements, pairfreqs, compctrl=False, mincodeunit=12
 
     return False
 
-def dte_compress(lines, compctrl=False, checkfreqs=True, mincodeunit=128):
+def dte_pair_allowed(pair, compctrl=False):
+    return compctrl or (pair[0] >= FIRST_PRINTABLE_CU
+                        and pair[1] >= FIRST_PRINTABLE_CU)
+
+def dte_compress(lines, compctrl=False, checkfreqs=False, mincodeunit=128):
     """Compress a set of byte strings with DTE.
 
+lines -- a list of byte strings to compress, where no code unit
+    is greater than mincodeunit
+compctrl -- if False, exclude control characters ('\x00'-'\x1F')
+from compression; if True, compress them as any other
+checkfreqs -- if True, check pair frequencies against a full recount
+after each replacement (slow)
+
+Return (lines, replacements, pairfreqs), where pairfreqs maps each
+pair still in lines to its frequency.  Chooses the same pairs as
+dte_compress_rescan: the most frequent, breaking ties by lowest
+code units.
+
+The lines are held as doubly linked lists of code units, and each
+pair maps to the set of positions where it occurs, so replacing a
+pair visits only its own occurrences and their neighbors.  The most
+frequent pair comes from a heap that is updated lazily: a pair is
+pushed when its frequency rises, and an entry found stale on pop is
+pushed again with the current frequency or dropped.
+"""
+    # Flatten the lines into one sequence of code units with links.
+    # The first position of each line is never removed, as a
+    # replacement at p removes only the position after p.
+    syms, prevs, nexts, line_starts = [], [], [], []
+    for line in lines:
+        start = len(syms)
+        line_starts.append(start if line else -1)
+        syms.extend(line)
+        prevs.extend(range(start - 1, start + len(line) - 1))
+        nexts.extend(range(start + 1, start + len(line) + 1))
+        if line:
+            prevs[start] = nexts[-1] = -1
+
+    # positions[pair] is the set of positions p where the pair
+    # (syms[p], syms[nexts[p]]) begins, including overlaps:
+    # oooo is three of oo
+    positions = defaultdict(set)
+    for p, q in enumerate(nexts):
+        if q >= 0:
+            positions[syms[p], syms[q]].add(p)
+
+    heap = [(-len(ps), pair) for pair, ps in positions.items()
+            if dte_pair_allowed(pair, compctrl)]
+    heapq.heapify(heap)
+    raised = set()
+
+    def remove(pair, p):
+        positions[pair].discard(p)
+
+    def add(pair, p):
+        positions[pair].add(p)
+        raised.add(pair)
+
+    replacements = []
+    while len(replacements) < 256 - mincodeunit:
+        # Find the most frequent pair
+        strpair = None
+        while heap:
+            negfreq, pair = heap[0]
+            freq = len(positions.get(pair, ()))
+            if freq == -negfreq:
+                strpair = pair
+                break
+            heapq.heappop(heap)
+            if 0 < freq < -negfreq:
+                heapq.heappush(heap, (-freq, pair))
+        if strpair is None or freq < MINFREQ:
+            break
+        heapq.heappop(heap)
+
+        # Allocate new symbol
+        newsym = mincodeunit + len(replacements)
+        replacements.append(bytes(strpair))
+
+        # Replace left to right without overlap, as bytes.replace does
+        a, b = strpair
+        for p in sorted(positions.pop(strpair)):
+            q = nexts[p]
+            if syms[p] != a or q < 0 or syms[q] != b:
+                continue  # removed or rewritten by an earlier replacement
+            l, r = prevs[p], nexts[q]
+            if l >= 0:
+                remove((syms[l], a), l)
+            if r >= 0:
+                remove((b, syms[r]), q)
+            syms[p], syms[q] = newsym, None
+            nexts[p] = r
+            if r >= 0:
+                prevs[r] = p
+            if l >= 0:
+                add((syms[l], newsym), l)
+            if r >= 0:
+                add((newsym, syms[r]), p)
+
+        for pair in raised:
+            freq = len(positions[pair])
+            if freq and dte_pair_allowed(pair, compctrl):
+                heapq.heappush(heap, (-freq, pair))
+        raised.clear()
+
+        if checkfreqs:
+            dte_check_positions(positions, syms, nexts, line_starts)
+
+    # Read the lines back out of the linked lists
+    for i, start in enumerate(line_starts):
+        out = bytearray()
+        p = start
+        while p >= 0:
+            out.append(syms[p])
+            p = nexts[p]
+        lines[i] = bytes(out)
+
+    pairfreqs = {bytes(pair): len(ps) for pair, ps in positions.items() if ps}
+    return lines, replacements, pairfreqs
+
+def dte_check_positions(positions, syms, nexts, line_starts):
+    """Compare the pair positions in dte_compress to a full recount."""
+    expected = defaultdict(set)
+    for start in line_starts:
+        p = start
+        while p >= 0 and syms[p] is not None:
+            q = nexts[p]
+            if q < 0:
+                break
+            expected[syms[p], syms[q]].add(p)
+            p = q
+    actual = {pair: ps for pair, ps in positions.items() if ps}
+    if actual != expected:
+        for pair in sorted(set(actual) | set(expected)):
+            if actual.get(pair) != expected.get(pair):
+                print("Frequency pair scan problem: %s %d!=expected %d"
+                      % (repr(bytes(pair)), len(actual.get(pair, ())),
+                         len(expected.get(pair, ()))),
+                      file=sys.stderr)
+        assert False
+
+def dte_compress_rescan(lines, compctrl=False, checkfreqs=True, mincodeunit=128):
+    """Compress a set of byte strings with DTE by rescanning all lines.
+
+This is the original compressor, kept to check dte_compress against.
+It is O(k*n) and does not honor compctrl.
+
 lines -- a list of byte strings to compress, where no code unit
     is greater than mincodeunit
 compctrl -- if False, exclude control characters ('\x00'-'\x1F')
@@ -226,16 +371,22 @@ def dte_uncompress(line, replacements, mincodeunit=128):
 
 def dte_tests():
     import a53charset
+    a53charset.register()
     inputdatas = [
         "The fat cat sat on the mat.",
         'boooooobies booooooobies',
         lipsum,
     ]
-    with open("../src/helppages.txt", "r") as infp:
-        inputdatas.append(infp.read())
+    try:
+        with open("../src/helppages.txt", "r") as infp:
+            inputdatas.append(infp.read())
+    except FileNotFoundError:
+        pass
     for text in inputdatas:
         lines = [text.encode("action53")]
-        ctxt, replacements, pairfreqs = dte_compress(lines)
+        expected = dte_compress_rescan(list(lines))
+        ctxt, replacements, pairfreqs = dte_compress(lines, checkfreqs=True)
+        assert (ctxt, replacements) == expected[:2]
         print("compressed %d chaacters to %d bytes and %d replacements"
               % (len(text), len(ctxt[0]), len(replacements)))
         dtxt, stkd = dte_uncompress(ctxt[0], replacements)
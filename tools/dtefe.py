@@ -3,10 +3,11 @@
 Python frontend for JRoatch's C language DTE compressor
 license: zlib
 """
-import sys, os, subprocess
+import sys, os, subprocess, hashlib
+
+dte_path = os.path.join(os.path.dirname(__file__), "dte")
 
 def dte_compress(lines, compctrl=False, mincodeunit=128):
-    dte_path = os.path.join(os.path.dirname(__file__), "dte")
     delimiter = b'\0'
     if len(lines) > 1:
         unusedvalues = set(range(1 if compctrl else 32))
@@ -29,6 +30,46 @@ def dte_compress(lines, compctrl=False, mincodeunit=128):
     clines = spresult.stdout[table_len:].split(delimiter)
     return clines, repls, None
 
+def dte_codec_id():
+    """Identify the dte executable by a hash of its contents."""
+    try:
+        with open(dte_path, 'rb') as infp:
+            return 'dte ' + hashlib.sha256(infp.read()).hexdigest()
+    except OSError:
+        return 'dte missing'
+
+def dte_cache_key(lines, compctrl=False, mincodeunit=128):
+    """Make a build cache key for compressing lines with dte_compress."""
+    from buildcache import BuildCache
+    return BuildCache.make_key('dte', dte_codec_id(), str(mincodeunit),
+                               'compctrl' if compctrl else '', *lines)
+
+def dte_compress_cached(lines, cache, compctrl=False, mincodeunit=128):
+    """Compress lines with dte_compress, reusing a cached result.
+
+cache -- a BuildCache, or None to always compress
+
+Each cache entry is the replacement table followed by each line
+with a NUL terminator, the same as a53build puts them in the ROM.
+A result with NUL in a line is not cached.
+
+Return the same as dte_compress.
+"""
+    if cache is None:
+        return dte_compress(lines, compctrl, mincodeunit)
+    key = dte_cache_key(lines, compctrl, mincodeunit)
+    table_len = (256 - mincodeunit) * 2
+    data = cache.get(key)
+    if data is not None:
+        repls = [data[i:i + 2] for i in range(0, table_len, 2)]
+        clines = data[table_len:].split(b'\0')[:-1]
+        if len(clines) == len(lines):
+            return clines, repls, None
+    clines, repls = dte_compress(lines, compctrl, mincodeunit)[:2]
+    if not any(b'\0' in line for line in clines):
+        cache.put(key, b''.join(repls) + b''.join(line + b'\0' for line in clines))
+    return clines, repls, None
+
 def main(argv=None):
     argv = argv or sys.argv
     with open(argv[1], "rb") as infp:
@@ -12,12 +12,18 @@ without any warranty.
 
 from __future__ import with_statement
 
-def load_ines(filename):
+def load_ines(filename, use_mmap=False):
     """Load an NES executable in iNES format.
 
 DiskDude! and other corruptions are automatically recognized and
 disregarded.
 
+If use_mmap is true, read only the header up front, and make 'prg'
+and 'chr' read-only memoryviews of a memory map of the file.  The OS
+reads their pages only as they are used, and can drop them again
+under memory pressure, so a program can have a large library of ROMs
+open at once.
+
 Return a dictionary with these keys:
 'prg': PRG ROM data
 'chr' (optional): CHR ROM data
@@ -60,12 +66,23 @@ AABB=horizontal, ABAB=vertical, ABCD=4 screen)
         if not prgSize:
             raise ValueError("rom has no PRG memory")
 
-        out['prg'] = infp.read(prgSize * 16384)
-        if chrSize > 0:
-            out['chr'] = infp.read(chrSize * 8192)
+        if use_mmap:
+            import mmap
+            start = infp.tell()
+            data = memoryview(mmap.mmap(infp.fileno(), 0,
+                                        access=mmap.ACCESS_READ))
+            out['prg'] = data[start:start + prgSize * 16384]
+            start += prgSize * 16384
+            if chrSize > 0:
+                out['chr'] = data[start:start + chrSize * 8192]
+            del data
+        else:
+            out['prg'] = infp.read(prgSize * 16384)
+            if chrSize > 0:
+                out['chr'] = infp.read(chrSize * 8192)
 
-    # And at this point we've loaded the entire ROM.  All that's
-    # left is to set up the board.
+    # And at this point we've loaded (or mapped) the entire ROM.  All
+    # that's left is to set up the board.
     mapperNumber = ((header[6] & 0xF0) >> 4
                     | (header[7] & 0xF0))
     if nes2:
@@ -25,8 +25,17 @@ pixel tiles with two bit planes.  Possible formats are as follows:
 * Repeat tile from previous pattern table: Repeat 16 bytes starting
   4096 bytes back
 
+Data is divided into segments (4096 bytes by default), each of which
+starts on its own without a repeat of the previous tile, so that a
+decoder can start at any seek point.  A segment's repeats from the
+previous pattern table refer to uncompressed data, so pb53() can
+compress all segments at once in separate processes.
+
 """
 
+import functools
+import operator
+
 def pb8_oneplane(planedata, topValue=None):
     ctile = bytearray([0])
     lastc = topValue
@@ -41,13 +50,82 @@ def pb8_oneplane(planedata, topValue=None):
     ctile[0] = flag
     return ctile
 
-def pb53(chrdata, segsize=4096, copyprev=True):
+# Expansions of each solid plane and solid tile, indexed by the low
+# bits of its control byte
+SOLID_PLANES = (bytes(8), b'\xff'*8)
+SOLID_TILES = tuple(SOLID_PLANES[i & 1] + SOLID_PLANES[i >> 1]
+                    for i in range(4))
+SOLID_PLANE_IDS = {plane: i for (i, plane) in enumerate(SOLID_PLANES)}
+INVERT = bytes(range(255, -1, -1))
+
+@functools.lru_cache(maxsize=4096)
+def pb8_plane_cached(plane):
+    """Return pb8_oneplane(plane) as bytes, memoized."""
+    return bytes(pb8_oneplane(plane))
+
+def pb53_segment(segdata, prevdata=b'', copyprev=True):
+    """Compress one segment of tile data with PB53.
+
+segdata -- byte string, padded with $00 to a multiple of 16 bytes
+prevdata -- the previous segment's tile data, or b'' if this is the
+first segment
+copyprev -- if enabled, allow tiles to reference the same numbered
+tile in prevdata
+
+Segments depend only on the uncompressed data of the segment before
+them, not on its compressed data, so they can be compressed in any
+order or in parallel.
+
+Return the compressed data as bytes.
+"""
+    out = bytearray()
+    if not copyprev:
+        prevdata = b''
+    prev_tile = None
+    for i in range(0, len(segdata), 16):
+        tile = segdata[i:i + 16]
+        plane0, plane1 = tile[:8], tile[8:]
+        solid0 = SOLID_PLANE_IDS.get(plane0)
+        solid1 = SOLID_PLANE_IDS.get(plane1)
+
+        # Solid color tiles: $84-$87
+        if solid0 is not None and solid1 is not None:
+            out.append(0x84 | (solid1 << 1) | solid0)
+        # Duplicate previous tile in same segment: $82
+        elif tile == prev_tile:
+            out.append(0x82)
+        # Duplicate tile from previous segment: $83
+        elif tile == prevdata[i:i + 16]:
+            out.append(0x83)
+        else:
+            # Encode first plane
+            if solid0 is not None:
+                out.append(0x80 | solid0)
+            else:
+                out.extend(pb8_plane_cached(plane0))
+
+            # Encode second plane
+            if solid1 is not None:
+                out.append(0x80 | solid1)
+            elif plane1 == plane0:
+                # Colors 0 and 3
+                out.append(0x82)
+            elif plane1 == plane0.translate(INVERT):
+                # Colors 1 and 2
+                out.append(0x83)
+            else:
+                out.extend(pb8_plane_cached(plane1))
+        prev_tile = tile
+    return bytes(out)
+
+def pb53(chrdata, segsize=4096, copyprev=True, jobs=1):
     """Compress tile data with PB53.
 
 chrdata -- byte string
 segsize -- length of each segment
 copyprev -- if enabled, allow tiles to reference the same numbered
 tile in the previous segment
+jobs -- number of processes among which to divide segments
 
 Return (pb53data, seekpoints)
 pb53 is the compressed data
@@ -55,62 +133,25 @@ seekpoints is an array of indices of the start of the compressed data
 for each segment after the first
 
 """
-    out = bytearray()
-    seekpoints = []
-
-    for i in range(0, len(chrdata), 16):
-        is_first_in_seg = i % segsize == 0
-        if i > 0 and is_first_in_seg:
-            seekpoints.append(len(out))
-        tile = chrdata[i:i + 16]
-        if len(tile) < 16:
-            tile = bytearray(tile)
-            tile.extend(bytearray(16 - len(tile)))
-
-        # Solid color tiles: $84-$87
-        solid0 = (tile[0] in (0x00, 0xFF)
-                  and all(x == tile[0] for x in tile[1:8]))
-        solid1 = (tile[8] in (0x00, 0xFF)
-                  and all(x == tile[8] for x in tile[9:16]))
-        if solid0 and solid1:
-            ctrlbyte = 0x84 | (0x02 & tile[8]) | (0x01 & tile[0])
-            out.append(ctrlbyte)
-            continue
-
-        # Duplicate previous tile in same segment: $82
-        if not is_first_in_seg and chrdata[i - 16:i] == tile:
-            out.append(0x82)
-            continue
-
-        # Duplicate tile from previous segment: $83
-        if (copyprev and i >= segsize
-            and chrdata[i - segsize:i - segsize + 16] == tile):
-            out.append(0x83)
-            continue
+    chrdata = bytes(chrdata)
+    if len(chrdata) % 16:
+        chrdata += bytes(16 - len(chrdata) % 16)
+    segs = [chrdata[i:i + segsize] for i in range(0, len(chrdata), segsize)]
+    prevs = [b''] + segs[:-1]
+    if jobs > 1 and len(segs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(min(jobs, len(segs))) as executor:
+            csegs = list(executor.map(pb53_segment, segs, prevs,
+                                      [copyprev] * len(segs)))
+    else:
+        csegs = [pb53_segment(seg, prev, copyprev)
+                 for (seg, prev) in zip(segs, prevs)]
 
-        # Encode first plane
-        if solid0:
-            ctrlbyte = 0x80 | (0x01 & tile[0])
-            out.append(ctrlbyte)
-        else:
-            pb = pb8_oneplane(tile[0:8])
-            out.extend(pb)
-
-        # Encode second plane
-        if solid1:
-            ctrlbyte = 0x80 | (0x01 & tile[8])
-            out.append(ctrlbyte)
-        elif tile[0:8] == tile[8:16]:
-            # Colors 0 and 3
-            ctrlbyte = 0x82
-            out.append(ctrlbyte)
-        elif all(a ^ b == 0xFF for (a, b) in zip(tile[0:8], tile[8:16])):
-            # Colors 1 and 2
-            ctrlbyte = 0x83
-            out.append(ctrlbyte)
-        else:
-            pb = pb8_oneplane(tile[8:16])
-            out.extend(pb)
+    out = bytearray(csegs[0] if csegs else b'')
+    seekpoints = []
+    for cseg in csegs[1:]:
+        seekpoints.append(len(out))
+        out.extend(cseg)
     return (out, seekpoints)
 
 def unpb53plane(ctrlbyte, it):
@@ -123,43 +164,82 @@ def unpb53plane(ctrlbyte, it):
         ctrlbyte = ctrlbyte << 1
         p0data.append(p0data[-1] if ctrlbyte & 0x80 else next(it))
     return p0data
-    
-def unpb53(data, numTiles=None, segsize=4096):
+
+def _pb8_sources(ctrlbyte):
+    sources, n = [0], 0
+    for i in range(6, -1, -1):
+        if not ctrlbyte & (1 << i):
+            n += 1
+        sources.append(n)
+    return sources
+
+# PB8_EXPAND[ctrlbyte] picks the 8 bytes of a plane from the
+# literal bytes following a pb8 control byte below $80, and
+# PB8_LENGTH[ctrlbyte] is how many literal bytes there are
+PB8_EXPAND = tuple(operator.itemgetter(*_pb8_sources(ctrlbyte))
+                   for ctrlbyte in range(128))
+PB8_LENGTH = tuple(_pb8_sources(ctrlbyte)[-1] + 1 for ctrlbyte in range(128))
+
+def unpb53_with_length(data, numTiles=None, segsize=4096):
+    """Decompress PB53 data from a bytes-like object.
+
+This does the same as unpb53(), but it indexes into a memoryview of
+data and expands each plane through a lookup table.
+
+numTiles -- stop after this many tiles, or None to decompress all
+of data
+
+Return (bytearray of tile data, number of bytes of data used), or
+raise ValueError if data ends in the middle of a tile.
+"""
+    mv = memoryview(data).cast('B')
+    data_len = len(mv)
+    max_len = None if numTiles is None else numTiles * 16
     out = bytearray()
-    it = iter(data)
-    for ctrlbyte in it:
-        if numTiles is not None and len(out) >= numTiles * 16:
-            break
-
-        if ctrlbyte >= 0x84 and ctrlbyte <= 0x87:
-            # Solid color tiles
-            p0data = 0xFF if (ctrlbyte & 0x01) else 0x00
-            out.extend([p0data] * 8)
-            p1data = 0xFF if (ctrlbyte & 0x02) else 0x00
-            out.extend([p1data] * 8)
-            continue
-
-        if ctrlbyte == 0x82:
-            # Repeat previous tile
-            out.extend(out[-16:])
-            continue
-
-        if ctrlbyte == 0x83:
-            # Repeat corresponding tile from other bank
-            out.extend(out[-segsize:-segsize + 16])
-            continue
-
-        # Decode each plane
-        out.extend(unpb53plane(ctrlbyte, it))
-        ctrlbyte = next(it)
-        if ctrlbyte in (0x82, 0x83):
-            # 2-color plane, colors 0/3 or 1/2
-            xorbyte = 0xFF if (ctrlbyte & 0x01) else 0x00
-            out.extend(c ^ xorbyte for c in out[-8:])
-        else:
-            out.extend(unpb53plane(ctrlbyte, it))
+    pos = 0
+    try:
+        while pos < data_len and (max_len is None or len(out) < max_len):
+            ctrlbyte = mv[pos]
+            pos += 1
+            if 0x84 <= ctrlbyte <= 0x87:
+                # Solid color tiles
+                out.extend(SOLID_TILES[ctrlbyte & 0x03])
+                continue
+            if ctrlbyte == 0x82:
+                # Repeat previous tile
+                out.extend(out[-16:])
+                continue
+            if ctrlbyte == 0x83:
+                # Repeat corresponding tile from other bank
+                out.extend(out[-segsize:-segsize + 16])
+                continue
+
+            # Decode each plane
+            for plane in range(2):
+                if plane:
+                    ctrlbyte = mv[pos]
+                    pos += 1
+                    if ctrlbyte in (0x82, 0x83):
+                        # 2-color plane, colors 0/3 or 1/2
+                        plane0 = out[-8:]
+                        out.extend(plane0.translate(INVERT)
+                                   if ctrlbyte & 0x01 else plane0)
+                        break
+                if ctrlbyte >= 0x80:
+                    # Solid plane
+                    out.extend(SOLID_PLANES[ctrlbyte & 0x01])
+                    continue
+                end = pos + PB8_LENGTH[ctrlbyte]
+                if end > data_len:
+                    raise IndexError
+                out.extend(PB8_EXPAND[ctrlbyte](mv[pos:end]))
+                pos = end
+    except IndexError:
+        raise ValueError("PB53 data ends within tile %d" % (len(out) // 16))
+    return (out, pos)
 
-    return out
+def unpb53(data, numTiles=None, segsize=4096):
+    return unpb53_with_length(data, numTiles, segsize)[0]
 
 roms = [
     '../../my_games/Concentration Room 0.02.nes',
@@ -202,6 +282,9 @@ def parse_argv(argv):
     parser.add_option("--raw", dest="withHeader",
                       help="don't write 2-byte length and segment seek points",
                       action="store_false", default=True)
+    parser.add_option("-j", "--jobs", dest="jobs",
+                      help="compress segments in up to JOBS processes (default 1)", metavar="JOBS",
+                      type="int", default=1)
     parser.add_option("-i", "--input", dest="infilename",
                       help="read input from INFILE", metavar="INFILE")
     parser.add_option("-o", "--output", dest="outfilename",
@@ -233,7 +316,8 @@ def parse_argv(argv):
             raise ValueError('cannot compress to terminal')
 
     return (infilename, outfilename, options.unpacking,
-            options.blocksize, options.copyprev, options.withHeader)
+            options.blocksize, options.copyprev, options.withHeader,
+            options.jobs)
 
 argvTestingMode = True
 
@@ -246,7 +330,7 @@ def main(argv=None):
             argv.extend(input('args:').split())
     try:
         (infilename, outfilename, unpacking,
-         blocksize, copyprev, withHeader) = parse_argv(argv)
+         blocksize, copyprev, withHeader, jobs) = parse_argv(argv)
     except Exception as e:
         import sys
         sys.stderr.write("%s: %s\n" % (argv[0], str(e)))
@@ -274,11 +358,11 @@ def main(argv=None):
         else:
             numTiles = None
             startOffset = 0
-        outdata = unpb53(data[startOffset:], blocksize * 16, copyprev)
+        outdata = unpb53(data[startOffset:], numTiles, blocksize * 16)
     else:
 
         # Compress input file
-        (outdata, seekpoints) = pb53(data, blocksize * 16, copyprev)
+        (outdata, seekpoints) = pb53(data, blocksize * 16, copyprev, jobs)
         if withHeader:
 
             # The .pb53 header is the unpacked length in 16-byte units,
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped output image for assembling an Action 53 ROM
+Copyright 2026 Action 53 contributors
+zlib license
+
+Rather than copying each 32 KiB PRG bank into its own bytearray and
+writing them all out at the end, a53build allocates the whole output
+file up front and maps it into memory.  Each bank is a memoryview
+window into the map, so patches, inserted data, and checksums are
+written in place, and the OS can page out parts of the image that
+aren't being worked on.
+
+The image is built in filename.tmp and renamed to filename by
+commit().  If the build fails, the .tmp file is left behind.
+"""
+import os
+import mmap
+
+INES_HEADER_SIZE = 16
+PRG_BANK_SIZE = 32768
+
+class RomImage(object):
+    """An iNES file with no CHR ROM, built in place.
+
+filename -- name of the .nes file to create
+num_banks -- number of 32 KiB PRG banks
+
+.header is a memoryview of the 16-byte iNES header.
+.banks is a list of memoryviews, one for each PRG bank.
+.mm is the mmap of the whole file, usable as a bytes-like object.
+"""
+
+    def __init__(self, filename, num_banks):
+        self.filename = filename
+        self.tmpname = filename + '.tmp'
+        size = INES_HEADER_SIZE + num_banks * PRG_BANK_SIZE
+        self.fp = open(self.tmpname, 'w+b')
+        self.fp.truncate(size)
+        self.mm = mmap.mmap(self.fp.fileno(), size)
+        self.view = memoryview(self.mm)
+        self.header = self.view[:INES_HEADER_SIZE]
+        self.banks = [
+            self.view[start:start + PRG_BANK_SIZE]
+            for start in range(INES_HEADER_SIZE, size, PRG_BANK_SIZE)
+        ]
+
+    def load_banks(self, prgbanks):
+        """Copy the data of PRG banks into the image.
+
+prgbanks -- a list of (bytes-like object, slice list) tuples, one
+    for each bank of the image
+
+Return a list of (memoryview, slice list) tuples for the same banks.
+"""
+        if len(prgbanks) != len(self.banks):
+            raise ValueError("image has %d banks, not %d"
+                             % (len(self.banks), len(prgbanks)))
+        for (window, (romdata, unused_ranges)) in zip(self.banks, prgbanks):
+            window[:] = romdata
+        return [(window, unused_ranges)
+                for (window, (romdata, unused_ranges))
+                in zip(self.banks, prgbanks)]
+
+    def commit(self):
+        """Write the image to disk and rename it to its filename.
+
+All memoryviews sliced from .header and .banks must be gone.
+"""
+        self.mm.flush()
+        for view in self.banks:
+            view.release()
+        self.header.release()
+        self.view.release()
+        self.mm.close()
+        self.fp.close()
+        os.replace(self.tmpname, self.filename)